@@ -2,15 +2,31 @@
 Claude Agent SDK Service for Excel Analysis
 """
 import asyncio
+import collections
+import contextlib
+import dataclasses
+import functools
+import inspect
 import json
+import logging
 import os
+import queue
+import re
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime
 from claude_agent_sdk import (
     ClaudeAgentOptions,
     ClaudeSDKClient,
+    TextBlock,
+    ThinkingBlock,
+    ToolResultBlock,
+    ToolUseBlock,
     create_sdk_mcp_server
 )
+from job_store import generate_run_id
 from excel_mcp_tools import (
     analyze_excel,
     create_visualization,
@@ -22,6 +38,18 @@ from excel_mcp_tools import (
     trend_analysis
 )
 
+try:
+    import orjson
+except ImportError:  # orjson is optional - fall back to the stdlib encoder
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:  # uvloop is optional (and unavailable on Windows)
+    uvloop = None
+
+logger = logging.getLogger(__name__)
+
 # Verify API key is set
 if not os.environ.get('ANTHROPIC_API_KEY'):
     raise RuntimeError(
@@ -30,266 +58,8 @@ if not os.environ.get('ANTHROPIC_API_KEY'):
     )
 
 
-class ExcelAnalysisAgent:
-    """Wrapper for Claude Agent SDK to analyze Excel files."""
-
-    def __init__(self, output_dir: str = "outputs"):
-        self.output_dir = Path(output_dir)
-        self.output_dir.mkdir(exist_ok=True)
-
-        # Create MCP server with ALL Excel analysis tools
-        self.tools = [
-            analyze_excel,
-            create_visualization,
-            generate_insights,
-            create_dashboard,
-            correlation_analysis,
-            detect_outliers,
-            group_comparison,
-            trend_analysis
-        ]
-
-        self.mcp_server = create_sdk_mcp_server(
-            name="excel_tools",
-            version="1.0.0",
-            tools=self.tools
-        )
-
-        print(f"DEBUG: MCP Server created with {len(self.tools)} tools")
-        tool_names = []
-        for t in self.tools:
-            if hasattr(t, 'name'):
-                tool_names.append(t.name)
-            elif hasattr(t, '__name__'):
-                tool_names.append(t.__name__)
-            else:
-                tool_names.append(str(t))
-        print(f"DEBUG: Available tools: {tool_names}")
-
-    def _parse_event_to_log(self, event) -> dict:
-        """
-        Extract displayable information from SDK event for activity log.
-
-        Returns:
-            dict with timestamp, type, content, icon, and optional full_content for expansion
-        """
-        from datetime import datetime
-
-        timestamp = datetime.now().strftime("%H:%M:%S")
-
-        # Handle different event types
-        event_type = getattr(event, 'type', None)
-
-        # Check for content blocks
-        if hasattr(event, 'content'):
-            content_items = event.content if isinstance(event.content, list) else [event.content]
-
-            for item in content_items:
-                item_class_name = type(item).__name__
-
-                # THINKING BLOCK - Check by class name
-                if item_class_name == 'ThinkingBlock' or (hasattr(item, 'type') and item.type == 'thinking'):
-                    thinking_text = getattr(item, 'thinking', '') or getattr(item, 'text', '')
-                    if thinking_text:
-                        preview = thinking_text[:300] + '...' if len(thinking_text) > 300 else thinking_text
-                        return {
-                            'timestamp': timestamp,
-                            'type': 'thinking',
-                            'content': preview,
-                            'full_content': thinking_text,
-                            'icon': '🧠',
-                            'expandable': len(thinking_text) > 300
-                        }
-
-                # TEXT BLOCK - Agent talking (check by class name first, then by attribute)
-                elif item_class_name == 'TextBlock':
-                    text_content = getattr(item, 'text', '')
-                    if text_content and text_content.strip():
-                        preview = text_content[:300] + '...' if len(text_content) > 300 else text_content
-                        return {
-                            'timestamp': timestamp,
-                            'type': 'text',
-                            'content': preview,
-                            'full_content': text_content,
-                            'icon': '💬',
-                            'expandable': len(text_content) > 300
-                        }
-
-                # TOOL USE BLOCK - Check by class name
-                elif item_class_name == 'ToolUseBlock':
-                    tool_name = getattr(item, 'name', 'unknown_tool')
-                    tool_input = getattr(item, 'input', {})
-
-                    # Format tool call nicely based on tool type
-                    if tool_name == 'Bash':
-                        command = tool_input.get('command', '?')
-                        preview = command[:150] + '...' if len(command) > 150 else command
-                        return {
-                            'timestamp': timestamp,
-                            'type': 'tool',
-                            'content': f"Running: {preview}",
-                            'full_content': f"Running bash command:\n{command}",
-                            'icon': '⚙️',
-                            'expandable': len(command) > 150
-                        }
-                    elif tool_name == 'Edit':
-                        file_path = tool_input.get('file_path', '?')
-                        old_string = tool_input.get('old_string', '')[:100]
-                        return {
-                            'timestamp': timestamp,
-                            'type': 'tool',
-                            'content': f"Editing {file_path}",
-                            'full_content': f"Editing file: {file_path}\nReplacing: {old_string}...",
-                            'icon': '✏️',
-                            'expandable': False
-                        }
-                    elif tool_name == 'Write':
-                        file_path = tool_input.get('file_path', '?')
-                        return {
-                            'timestamp': timestamp,
-                            'type': 'tool',
-                            'content': f"Writing {file_path}",
-                            'full_content': f"Writing file: {file_path}",
-                            'icon': '📝',
-                            'expandable': False
-                        }
-                    elif tool_name == 'Read':
-                        file_path = tool_input.get('file_path', '?')
-                        return {
-                            'timestamp': timestamp,
-                            'type': 'tool',
-                            'content': f"Reading {file_path}",
-                            'full_content': f"Reading file: {file_path}",
-                            'icon': '📖',
-                            'expandable': False
-                        }
-                    else:
-                        input_str = json.dumps(tool_input, indent=2)
-                        preview = input_str[:150] + '...' if len(input_str) > 150 else input_str
-                        return {
-                            'timestamp': timestamp,
-                            'type': 'tool',
-                            'content': f"{tool_name}(...)",
-                            'full_content': f"{tool_name}:\n{input_str}",
-                            'icon': '🔧',
-                            'expandable': len(input_str) > 150
-                        }
-
-                # TOOL RESULT BLOCK - Check by class name
-                elif item_class_name == 'ToolResultBlock':
-                    tool_id = getattr(item, 'tool_use_id', 'unknown')
-                    result_content = getattr(item, 'content', '')
-                    is_error = getattr(item, 'is_error', False)
-
-                    # Extract useful info from result
-                    if isinstance(result_content, str):
-                        result_str = result_content
-                    elif isinstance(result_content, list) and len(result_content) > 0:
-                        first_item = result_content[0]
-                        if hasattr(first_item, 'text'):
-                            result_str = first_item.text
-                        else:
-                            result_str = str(result_content)
-                    else:
-                        result_str = str(result_content)
-
-                    preview = result_str[:200] + '...' if len(result_str) > 200 else result_str
-
-                    if is_error:
-                        return {
-                            'timestamp': timestamp,
-                            'type': 'error',
-                            'content': f"Error: {preview}",
-                            'full_content': f"Error:\n{result_str}",
-                            'icon': '❌',
-                            'expandable': len(result_str) > 200
-                        }
-                    else:
-                        return {
-                            'timestamp': timestamp,
-                            'type': 'result',
-                            'content': f"✓ {preview}",
-                            'full_content': result_str,
-                            'icon': '✅',
-                            'expandable': len(result_str) > 200
-                        }
-
-        # Error events
-        if hasattr(event, 'error'):
-            error_str = str(event.error)
-            return {
-                'timestamp': timestamp,
-                'type': 'error',
-                'content': error_str,
-                'full_content': error_str,
-                'icon': '❌',
-                'expandable': False
-            }
-
-        # Skip events we don't recognize
-        return None
-
-    async def analyze_file(self, file_path: str, event_callback=None, additional_instructions=None,
-                          refinement_prompt=None, original_run_id=None, language="hebrew") -> dict:
-        """
-        Analyze Excel file using Claude Agent SDK.
-
-        Args:
-            file_path: Path to uploaded Excel file
-            event_callback: Optional callback function to receive real-time events
-            additional_instructions: Optional user instructions for initial analysis
-            refinement_prompt: Optional user feedback/refinement request
-            original_run_id: Optional ID of original analysis (for refinement context)
-            language: Output language (default: "hebrew"). Only changes if user explicitly requests
-
-        Returns:
-            dict with dashboard_path, insights, and execution log
-        """
-        # Check if user explicitly requested a different language
-        language_override = False
-        if additional_instructions:
-            lower_instructions = additional_instructions.lower()
-            if "english" in lower_instructions or "in english" in lower_instructions:
-                language = "english"
-                language_override = True
-            elif "arabic" in lower_instructions or "בערבית" in lower_instructions:
-                language = "arabic"
-                language_override = True
-            # Hebrew remains default unless explicitly changed
-        run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-        run_dir = self.output_dir / run_id
-        run_dir.mkdir(parents=True, exist_ok=True)
-
-        # System prompt for the agent - COMPREHENSIVE ANALYSIS MODE
-        # Adjust language requirements based on user preference
-        if language_override and language == "english":
-            language_instruction = """
-🌐 LANGUAGE REQUIREMENT:
-The user has explicitly requested ENGLISH output. Use English for all dashboard content."""
-            html_dir = 'ltr'
-            html_lang = 'en'
-        elif language_override and language == "arabic":
-            language_instruction = """
-🌐 LANGUAGE REQUIREMENT - ARABIC:
-The user has explicitly requested ARABIC output. Use Arabic for all dashboard content.
-- Use RTL (Right-to-Left) direction for Arabic text in HTML"""
-            html_dir = 'rtl'
-            html_lang = 'ar'
-        else:  # Default to Hebrew
-            language_instruction = """
-🌐 CRITICAL DEFAULT LANGUAGE - HEBREW (עברית):
-⚠️ ALWAYS use HEBREW for ALL outputs - THIS IS THE DEFAULT!
-- ALL dashboard text, titles, labels MUST be in Hebrew
-- ALL insights and analysis MUST be in Hebrew
-- ALL chart titles, axis labels, legends MUST be in Hebrew
-- ALL HTML content MUST be in Hebrew
-- Use RTL (Right-to-Left) direction
-- IGNORE input file language - OUTPUT HEBREW
-- This is the DEFAULT - do not use English unless explicitly requested!"""
-            html_dir = 'rtl'
-            html_lang = 'he'
-
-        system_prompt = f"""You are a world-class data scientist and analyst with unlimited time and resources.
+# Prompt templates - built once at import; analyze_file only fills in per-run values
+_SYSTEM_PROMPT_TEMPLATE = """You are a world-class data scientist and analyst with unlimited time and resources.
 {language_instruction}
 
 🎯 YOUR MISSION: Perform DEEP, EXHAUSTIVE analysis of the Excel file and create a stunning interactive dashboard.
@@ -359,11 +129,7 @@ The user has explicitly requested ARABIC output. Use Arabic for all dashboard co
 🔧 APPROACH: Whatever works best! Be creative and thorough.
 💡 GOAL: Impress the user with deep insights and beautiful visualizations."""
 
-        # Build user prompt based on whether this is a refinement or initial analysis
-        if refinement_prompt and original_run_id:
-            # Refinement mode - reference previous work
-            original_dir = self.output_dir / original_run_id
-            user_prompt = f"""ANALYSIS REFINEMENT REQUEST - HEBREW OUTPUT REQUIRED:
+_REFINEMENT_PROMPT_TEMPLATE = """ANALYSIS REFINEMENT REQUEST - HEBREW OUTPUT REQUIRED:
 
 🇮🇱 חשוב: כל הפלט חייב להיות בעברית!
 ⚠️ LANGUAGE: ALL OUTPUT MUST BE IN HEBREW
@@ -413,11 +179,8 @@ The user has reviewed your previous analysis and provided feedback above. Your j
 🎯 GOAL: Deliver exactly what the user asked for!
 
 Begin your refinement now!"""
-        else:
-            # Initial analysis mode
-            # Build base prompt with appropriate language emphasis
-            if not language_override:  # Hebrew is default
-                base_prompt = f"""DEEP ANALYSIS REQUEST - DEFAULT LANGUAGE: HEBREW:
+
+_INITIAL_PROMPT_TEMPLATE = """DEEP ANALYSIS REQUEST - DEFAULT LANGUAGE: HEBREW:
 
 🇮🇱 ברירת מחדל: עברית!
 ⚠️ DEFAULT OUTPUT LANGUAGE: HEBREW (עברית)
@@ -432,9 +195,8 @@ Begin your refinement now!"""
 
 🚀 YOUR TASK:
 Analyze this Excel file and create dashboard IN HEBREW (ברירת המחדל)."""
-            else:  # User explicitly requested different language
-                lang_name = language.upper()
-                base_prompt = f"""DEEP ANALYSIS REQUEST - USER REQUESTED {lang_name}:
+
+_INITIAL_PROMPT_LANGUAGE_TEMPLATE = """DEEP ANALYSIS REQUEST - USER REQUESTED {lang_name}:
 
 📁 Excel File: {file_path}
 📂 Output Directory: {run_dir}
@@ -443,17 +205,14 @@ Analyze this Excel file and create dashboard IN HEBREW (ברירת המחדל)."
 🚀 YOUR TASK:
 Analyze this Excel file and create dashboard in {lang_name} as requested."""
 
-            # Add user's custom instructions if provided
-            if additional_instructions:
-                base_prompt += f"""
+_USER_INSTRUCTIONS_TEMPLATE = """
 
 📝 USER'S SPECIFIC INSTRUCTIONS:
 {additional_instructions}
 
 Make sure to incorporate these specific instructions into your analysis!"""
 
-            # Complete the prompt with requirements
-            user_prompt = base_prompt + """
+_REQUIREMENTS_PROMPT = """
 
 ✅ REQUIREMENTS - כל הדרישות בעברית:
 1. 🇮🇱 חובה: כל התוכן בעברית - כותרות, תוויות, טקסט, הכל!
@@ -486,81 +245,796 @@ Make sure to incorporate these specific instructions into your analysis!"""
 
 Begin your analysis now!"""
 
-        # Verify API key is in environment (SDK reads it automatically)
-        api_key = os.environ.get('ANTHROPIC_API_KEY')
-        if not api_key:
-            raise RuntimeError("ANTHROPIC_API_KEY not found in environment")
+# Language requirement blocks for the system prompt (Hebrew is the default)
+_LANGUAGE_INSTRUCTIONS = {
+    "english": """
+🌐 LANGUAGE REQUIREMENT:
+The user has explicitly requested ENGLISH output. Use English for all dashboard content.""",
+    "arabic": """
+🌐 LANGUAGE REQUIREMENT - ARABIC:
+The user has explicitly requested ARABIC output. Use Arabic for all dashboard content.
+- Use RTL (Right-to-Left) direction for Arabic text in HTML""",
+    "hebrew": """
+🌐 CRITICAL DEFAULT LANGUAGE - HEBREW (עברית):
+⚠️ ALWAYS use HEBREW for ALL outputs - THIS IS THE DEFAULT!
+- ALL dashboard text, titles, labels MUST be in Hebrew
+- ALL insights and analysis MUST be in Hebrew
+- ALL chart titles, axis labels, legends MUST be in Hebrew
+- ALL HTML content MUST be in Hebrew
+- Use RTL (Right-to-Left) direction
+- IGNORE input file language - OUTPUT HEBREW
+- This is the DEFAULT - do not use English unless explicitly requested!""",
+}
+
+# Words in the user's instructions that switch the output language away from Hebrew
+_LANGUAGE_REQUEST_RE = re.compile(r"english|arabic|בערבית", re.IGNORECASE)
+
+# Output language -> (system prompt, initial-analysis prompt header), rendered
+# once at import; a run picks one pair and fills in its file and directory
+_LANGUAGE_CONFIG = {
+    "hebrew": (
+        _SYSTEM_PROMPT_TEMPLATE.format(language_instruction=_LANGUAGE_INSTRUCTIONS["hebrew"]),
+        _INITIAL_PROMPT_TEMPLATE,
+    ),
+    "english": (
+        _SYSTEM_PROMPT_TEMPLATE.format(language_instruction=_LANGUAGE_INSTRUCTIONS["english"]),
+        _INITIAL_PROMPT_LANGUAGE_TEMPLATE.replace("{lang_name}", "ENGLISH"),
+    ),
+    "arabic": (
+        _SYSTEM_PROMPT_TEMPLATE.format(language_instruction=_LANGUAGE_INSTRUCTIONS["arabic"]),
+        _INITIAL_PROMPT_LANGUAGE_TEMPLATE.replace("{lang_name}", "ARABIC"),
+    ),
+}
+
+
+# Page written when the agent finishes without producing dashboard.html
+_FALLBACK_DASHBOARD_HTML = string.Template("""
+<!DOCTYPE html>
+<html dir="rtl" lang="he">
+<head>
+    <meta charset="UTF-8">
+    <title>ניתוח נתוני Excel</title>
+    <style>
+        body {
+            font-family: 'Segoe UI', 'Arial Hebrew', Arial, sans-serif;
+            margin: 20px;
+            direction: rtl;
+            text-align: right;
+        }
+        .container { max-width: 1200px; margin: 0 auto; }
+        h1 { color: #333; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>תוצאות ניתוח Excel</h1>
+        <h2>נתונים שנותחו:</h2>
+        <pre style="direction: ltr; text-align: left;">$data</pre>
+    </div>
+</body>
+</html>
+""")
+
+# Batch-aware event callbacks get entries in groups of up to this many,
+# or whatever has arrived within the delay (seconds), whichever comes first
+_CALLBACK_BATCH_SIZE = 16
+_CALLBACK_BATCH_DELAY = 0.02
+
+# Clock time shown next to each activity-log entry
+_TIMESTAMP_FORMAT = "%H:%M:%S"
+
+# Longest full_content kept on an activity-log entry; everything beyond this
+# stays in the agent's own output and is not shipped to the browser
+_MAX_FULL_CONTENT = 20000
+
+# (epoch second, formatted time) of the last activity-log timestamp
+_timestamp_cache = (None, '')
+
+
+def _timestamp():
+    """Current clock time for an activity-log entry, formatted at most once per second."""
+    global _timestamp_cache
+    second = int(time.time())
+    cached_second, formatted = _timestamp_cache
+    if cached_second != second:
+        formatted = time.strftime(_TIMESTAMP_FORMAT, time.localtime(second))
+        _timestamp_cache = (second, formatted)
+    return formatted
+
+
+def _clip(text, limit):
+    """Cut text to limit characters (adding '...'), slicing only when it is too long."""
+    if len(text) > limit:
+        return text[:limit] + '...'
+    return text
+
+
+def _truncate(text, limit):
+    """_clip that also reports whether anything was cut: (preview, truncated)."""
+    if len(text) > limit:
+        return text[:limit] + '...', True
+    return text, False
+
+
+def _format_json(data):
+    """Pretty-print a JSON value for display (uses orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(data, indent=2, ensure_ascii=False)
+
+
+def _bounded_tool_input(tool_input):
+    """
+    Clip long string values of a tool input before it is formatted for the
+    activity log - only the first _MAX_FULL_CONTENT characters are ever shown,
+    so there is no point encoding a whole file body passed to a tool.
+    """
+    if not isinstance(tool_input, dict):
+        return tool_input
+    return {
+        key: _clip(value, _MAX_FULL_CONTENT) if isinstance(value, str) else value
+        for key, value in tool_input.items()
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def _public_slots(cls) -> tuple:
+    """Public __slots__ names declared anywhere in cls's MRO."""
+    names = []
+    for klass in cls.__mro__:
+        slots = klass.__dict__.get("__slots__", ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        names.extend(name for name in slots if not name.startswith("_") and name not in names)
+    return tuple(names)
+
+
+def _event_default(obj):
+    """JSON fallback for SDK objects: public attributes if any, else str()."""
+    try:
+        attrs = vars(obj)
+    except TypeError:
+        # No __dict__ - read the (per-class cached) slot names instead
+        slots = _public_slots(type(obj))
+        if not slots:
+            return str(obj)
+        return {name: getattr(obj, name) for name in slots if hasattr(obj, name)}
+    return {k: v for k, v in attrs.items() if not k.startswith("_")}
+
+
+# ALL Excel analysis tools exposed to the agent through the MCP server
+_TOOLS = (
+    analyze_excel,
+    create_visualization,
+    generate_insights,
+    create_dashboard,
+    correlation_analysis,
+    detect_outliers,
+    group_comparison,
+    trend_analysis
+)
+
+
+# Tools that only read the Excel file; their results are reused while the file
+# is unchanged (the others also write chart/dashboard files)
+_CACHEABLE_TOOLS = frozenset({"analyze_excel", "generate_insights", "detect_outliers"})
+_TOOL_CACHE_SIZE = 128
+
+# (tool name, arguments, file mtime) -> tool result, least recently used first
+_tool_results = collections.OrderedDict()
+
+
+def _cached_tool(tool_def):
+    """Wrap a read-only tool so repeated calls on an unchanged file reuse the result."""
+    handler = tool_def.handler
+
+    async def cached_handler(args):
+        try:
+            key = (tool_def.name, json.dumps(args, sort_keys=True, default=repr),
+                   os.stat(args["file_path"]).st_mtime_ns)
+        except (KeyError, TypeError, OSError):
+            return await handler(args)
+
+        result = _tool_results.get(key)
+        if result is not None:
+            _tool_results.move_to_end(key)
+            return result
+
+        result = await handler(args)
+        if not result.get("is_error"):
+            _tool_results[key] = result
+            if len(_tool_results) > _TOOL_CACHE_SIZE:
+                _tool_results.popitem(last=False)
+        return result
+
+    return dataclasses.replace(tool_def, handler=cached_handler)
+
+
+# Tool handlers get their own pool, one thread per concurrent analysis, so a
+# long read_excel/write_html never holds up callback delivery on the loop's
+# small default executor
+_TOOL_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ANALYSIS_MAX_WORKERS', '4')), thread_name_prefix="agent-tool"
+)
+
+
+def _threaded_tool(tool_def):
+    """Run a tool's handler in a worker thread so its blocking pandas/plotly/file
+    work does not stall the shared agent loop (and every other run on it)."""
+    handler = tool_def.handler
+
+    async def threaded_handler(args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_TOOL_EXECUTOR, asyncio.run, handler(args))
+
+    return dataclasses.replace(tool_def, handler=threaded_handler)
+
+
+@functools.lru_cache(maxsize=1)
+def _build_mcp_server():
+    """Create the Excel tools MCP server once per process."""
+    tools = [_threaded_tool(t) for t in _TOOLS]
+    return create_sdk_mcp_server(
+        name="excel_tools",
+        version="1.0.0",
+        tools=[_cached_tool(t) if t.name in _CACHEABLE_TOOLS else t for t in tools]
+    )
+
+
+# Display names of the registered tools
+_TOOL_NAMES = tuple(getattr(t, 'name', getattr(t, '__name__', None)) or str(t) for t in _TOOLS)
+
+
+def _accepts_batches(callback) -> bool:
+    """True for event callbacks declared as callback(entries, end_of_batch=...)."""
+    try:
+        return 'end_of_batch' in inspect.signature(callback).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+class _CallbackBatcher:
+    """Delivers activity-log entries to a batch-aware callback in small groups."""
+
+    def __init__(self, callback, loop: asyncio.AbstractEventLoop):
+        self._callback = callback
+        self._loop = loop
+        self._pending = []
+        self._timer = None
+
+    def add(self, entry):
+        """Queue an entry; flush on a full batch or shortly after the first queued one."""
+        self._pending.append(entry)
+        if len(self._pending) >= _CALLBACK_BATCH_SIZE:
+            self.flush()
+        elif self._timer is None:
+            self._timer = self._loop.call_later(_CALLBACK_BATCH_DELAY, self.flush)
+
+    def flush(self, end_of_batch=False):
+        """Hand everything queued so far to the callback."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending:
+            entries, self._pending = self._pending, []
+            self._callback(entries, end_of_batch=end_of_batch)
+
+
+class _CallbackDispatcher:
+    """Runs the event callback on a worker thread, fed in order from a queue."""
+
+    def __init__(self, callback):
+        self._callback = callback
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._drain())
+
+    def put(self, *args, **kwargs):
+        """Queue one callback invocation; never blocks the receive loop."""
+        self._queue.put_nowait((args, kwargs))
+
+    async def close(self):
+        """Wait until everything queued so far has been delivered."""
+        await self._queue.join()
+        self._task.cancel()
+
+    def _call_all(self, calls):
+        for args, kwargs in calls:
+            try:
+                self._callback(*args, **kwargs)
+            except Exception as e:
+                logger.error("Event callback failed: %s", e)
+
+    async def _drain(self):
+        while True:
+            # Deliver whatever has piled up in one hop to the worker thread
+            calls = [await self._queue.get()]
+            while not self._queue.empty():
+                calls.append(self._queue.get_nowait())
+            try:
+                await asyncio.to_thread(self._call_all, calls)
+            finally:
+                for _ in calls:
+                    self._queue.task_done()
+
+
+class _EventLogWriter:
+    """Encodes and appends raw SDK events to a JSONL file on a background thread."""
+
+    _STOP = object()
+
+    def __init__(self, path: Path, serialize):
+        self._serialize = serialize
+        self._queue = queue.SimpleQueue()
+        self._file = open(path, 'ab')
+        self._thread = threading.Thread(target=self._run, name=f"events-log-{path.parent.name}", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, event):
+        """Queue an event for the writer thread; never blocks the caller."""
+        self._queue.put(event)
+
+    def close(self):
+        """Flush everything queued so far and close the file."""
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while True:
+                # Drain whatever has piled up and write it with a single call
+                batch = [self._queue.get()]
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = batch[-1] is self._STOP
+                if stop:
+                    batch.pop()
+                if batch:
+                    self._file.write(b"".join(self._serialize(event) for event in batch))
+                if stop:
+                    return
+        except Exception as e:
+            logger.error("Raw event log writer stopped: %s", e)
+        finally:
+            self._file.close()
+
+
+class ExcelAnalysisAgent:
+    """Wrapper for Claude Agent SDK to analyze Excel files."""
+
+    # Raw SDK events are only written to events.jsonl when explicitly enabled
+    # (debugging aid); the parsed activity log already carries what the UI needs
+    capture_raw_events = os.environ.get(
+        'EXCEL_AGENT_CAPTURE_RAW_EVENTS', ''
+    ).lower() in ('1', 'true', 'yes')
+
+    # Activity-log formatters, looked up by SDK block class name and, for
+    # blocks of other classes, by their `type` attribute
+    _HANDLERS_BY_CLASS = {
+        ThinkingBlock: '_log_thinking',
+        TextBlock: '_log_text',
+        ToolUseBlock: '_log_tool_use',
+        ToolResultBlock: '_log_tool_result',
+    }
+    _HANDLERS_BY_TYPE = {
+        'thinking': '_log_thinking',
+        'text': '_log_text',
+        'tool_use': '_log_tool_use',
+        'tool_result': '_log_tool_result',
+    }
 
-        print(f"DEBUG: API Key in environment: {api_key[:20]}... (length: {len(api_key)})")
+    def __init__(self, output_dir: str = "outputs"):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(exist_ok=True)
+
+        # MCP server with ALL Excel analysis tools (shared by every agent)
+        self.tools = _TOOLS
+        self.mcp_server = _build_mcp_server()
+
+        logger.info("MCP server ready with %d tools: %s", len(self.tools), ", ".join(_TOOL_NAMES))
 
-        # Configure MCP servers
+        # Content block class -> log formatter (None for blocks we don't display).
+        # The SDK block classes are known up front; anything else is resolved
+        # by class name on first sight and memoized.
+        self._block_handlers = {
+            cls: getattr(self, name) for cls, name in self._HANDLERS_BY_CLASS.items()
+        }
+        self._handlers_by_name = {
+            cls.__name__: handler for cls, handler in self._block_handlers.items()
+        }
+        self._type_handlers = {
+            block_type: getattr(self, name) for block_type, name in self._HANDLERS_BY_TYPE.items()
+        }
+
+        # Agent options that are the same for every run; analyze_file adds the
+        # per-run system prompt and working directory.
         # Note: Only using custom Excel tools for now
         # Playwright MCP requires different configuration approach
-        mcp_servers = {
-            "excel_tools": self.mcp_server
+        self._base_options = dict(
+            model="sonnet",
+            mcp_servers={"excel_tools": self.mcp_server},
+            permission_mode="bypassPermissions",  # Valid options: acceptEdits, bypassPermissions, default, plan
+            setting_sources=[],
+            max_turns=100,
+        )
+
+    def _block_handler(self, item):
+        """Return the log formatter for a content block, resolved once per block class."""
+        cls = type(item)
+        try:
+            return self._block_handlers[cls]
+        except KeyError:
+            pass
+
+        handler = self._handlers_by_name.get(cls.__name__)
+        self._block_handlers[cls] = handler
+        return handler
+
+    def _parse_event_to_log(self, event, result_data=None) -> dict:
+        """
+        Extract displayable information from SDK event for activity log.
+
+        Args:
+            event: SDK message
+            result_data: Optional dict that collects tool results found in the
+                same pass over the event's content blocks
+
+        Returns:
+            dict with timestamp, type, content, icon, and optional full_content for expansion
+        """
+        log_entry = None
+
+        # Check for content blocks
+        content = getattr(event, 'content', None)
+        if content is not None:
+            content_items = content if type(content) is list else (content,)
+
+            for item in content_items:
+                if result_data is not None:
+                    item_result = getattr(item, 'result', None)
+                    if isinstance(item_result, dict):
+                        result_data.update(item_result)
+
+                if log_entry is None:
+                    handler = self._block_handler(item)
+                    # Blocks of unknown classes may still identify themselves via their type
+                    if handler is None:
+                        handler = self._type_handlers.get(getattr(item, 'type', None))
+                    if handler is not None:
+                        log_entry = handler(item)
+                        if log_entry and result_data is None:
+                            return log_entry
+
+        if log_entry:
+            return log_entry
+
+        # Error events
+        try:
+            error = event.error
+        except AttributeError:
+            return None  # Skip events we don't recognize
+        error_str = str(error)
+        return {
+            'timestamp': _timestamp(),
+            'type': 'error',
+            'content': error_str,
+            'full_content': error_str,
+            'icon': '❌',
+            'expandable': False
+        }
+
+    @staticmethod
+    def _collect_tool_results(event, result_data):
+        """Merge dict tool results from the event's content blocks into result_data."""
+        content = getattr(event, 'content', None)
+        if type(content) is list:
+            for item in content:
+                item_result = getattr(item, 'result', None)
+                if isinstance(item_result, dict):
+                    result_data.update(item_result)
+
+    def _log_thinking(self, item):
+        """THINKING BLOCK - the agent's reasoning."""
+        try:
+            thinking_text = item.thinking
+        except AttributeError:
+            thinking_text = ''
+        if not thinking_text:
+            thinking_text = getattr(item, 'text', '')
+        if not thinking_text:
+            return None
+        preview, expandable = _truncate(thinking_text, 300)
+        return {
+            'timestamp': _timestamp(),
+            'type': 'thinking',
+            'content': preview,
+            'full_content': _clip(thinking_text, _MAX_FULL_CONTENT),
+            'icon': '🧠',
+            'expandable': expandable
         }
 
+    def _log_text(self, item):
+        """TEXT BLOCK - agent talking."""
+        try:
+            text_content = item.text
+        except AttributeError:
+            return None
+        if not (text_content and text_content.strip()):
+            return None
+        preview, expandable = _truncate(text_content, 300)
+        return {
+            'timestamp': _timestamp(),
+            'type': 'text',
+            'content': preview,
+            'full_content': _clip(text_content, _MAX_FULL_CONTENT),
+            'icon': '💬',
+            'expandable': expandable
+        }
+
+    def _log_tool_use(self, item):
+        """TOOL USE BLOCK - format the call nicely based on tool type."""
+        try:
+            tool_name = item.name
+        except AttributeError:
+            tool_name = 'unknown_tool'
+        try:
+            tool_input = item.input
+        except AttributeError:
+            tool_input = {}
+
+        if tool_name == 'Bash':
+            command = tool_input.get('command', '?')
+            preview, expandable = _truncate(command, 150)
+            return {
+                'timestamp': _timestamp(),
+                'type': 'tool',
+                'content': f"Running: {preview}",
+                'full_content': f"Running bash command:\n{_clip(command, _MAX_FULL_CONTENT)}",
+                'icon': '⚙️',
+                'expandable': expandable
+            }
+        elif tool_name == 'Edit':
+            file_path = tool_input.get('file_path', '?')
+            old_string = _clip(tool_input.get('old_string', ''), 100)
+            return {
+                'timestamp': _timestamp(),
+                'type': 'tool',
+                'content': f"Editing {file_path}",
+                'full_content': f"Editing file: {file_path}\nReplacing: {old_string}",
+                'icon': '✏️',
+                'expandable': False
+            }
+        elif tool_name == 'Write':
+            file_path = tool_input.get('file_path', '?')
+            return {
+                'timestamp': _timestamp(),
+                'type': 'tool',
+                'content': f"Writing {file_path}",
+                'full_content': f"Writing file: {file_path}",
+                'icon': '📝',
+                'expandable': False
+            }
+        elif tool_name == 'Read':
+            file_path = tool_input.get('file_path', '?')
+            return {
+                'timestamp': _timestamp(),
+                'type': 'tool',
+                'content': f"Reading {file_path}",
+                'full_content': f"Reading file: {file_path}",
+                'icon': '📖',
+                'expandable': False
+            }
+        else:
+            input_str = _format_json(_bounded_tool_input(tool_input))
+            return {
+                'timestamp': _timestamp(),
+                'type': 'tool',
+                'content': f"{tool_name}(...)",
+                'full_content': f"{tool_name}:\n{_clip(input_str, _MAX_FULL_CONTENT)}",
+                'icon': '🔧',
+                'expandable': len(input_str) > 150
+            }
+
+    def _log_tool_result(self, item):
+        """TOOL RESULT BLOCK - success or error output of a tool call."""
+        try:
+            result_content = item.content
+        except AttributeError:
+            result_content = ''
+        try:
+            is_error = item.is_error
+        except AttributeError:
+            is_error = False
+
+        # Extract useful info from result - the text of the first block if any
+        if isinstance(result_content, str):
+            result_str = result_content
+        else:
+            text = None
+            if isinstance(result_content, list) and result_content:
+                first_item = result_content[0]
+                # Blocks arrive as objects with .text or as raw {'type': 'text', 'text': ...} dicts
+                if isinstance(first_item, dict):
+                    text = first_item.get('text')
+                else:
+                    text = getattr(first_item, 'text', None)
+            result_str = text if isinstance(text, str) else str(result_content)
+
+        preview, expandable = _truncate(result_str, 200)
+        full_content = _clip(result_str, _MAX_FULL_CONTENT)
+
+        if is_error:
+            return {
+                'timestamp': _timestamp(),
+                'type': 'error',
+                'content': f"Error: {preview}",
+                'full_content': f"Error:\n{full_content}",
+                'icon': '❌',
+                'expandable': expandable
+            }
+        return {
+            'timestamp': _timestamp(),
+            'type': 'result',
+            'content': f"✓ {preview}",
+            'full_content': full_content,
+            'icon': '✅',
+            'expandable': expandable
+        }
+
+    async def analyze_file(self, file_path: str, event_callback=None, additional_instructions=None,
+                          refinement_prompt=None, original_run_id=None, language="hebrew",
+                          keep_events=None, run_id=None) -> dict:
+        """
+        Analyze Excel file using Claude Agent SDK.
+
+        Args:
+            file_path: Path to uploaded Excel file
+            event_callback: Optional callback function to receive real-time events.
+                Called per entry, or with lists of entries if it accepts an
+                end_of_batch keyword (True on the final batch of the run).
+                Runs on a worker thread, never on the event loop
+            additional_instructions: Optional user instructions for initial analysis
+            refinement_prompt: Optional user feedback/refinement request
+            original_run_id: Optional ID of original analysis (for refinement context)
+            language: Output language (default: "hebrew"). Only changes if user explicitly requests
+            keep_events: Write raw SDK events to events.jsonl (default: capture_raw_events)
+            run_id: Id (and output subdirectory) for this run; generated if not given
+
+        Returns:
+            dict with dashboard_path, insights, events_log (path to the raw
+            SDK event log, or None when raw capture is disabled) and run_id
+        """
+        # Check if user explicitly requested a different language
+        language_override = False
+        if additional_instructions:
+            # One scan for every language keyword; English wins if both are mentioned
+            requested = {m.lower() for m in _LANGUAGE_REQUEST_RE.findall(additional_instructions)}
+            if "english" in requested:
+                language = "english"
+                language_override = True
+            elif requested:
+                language = "arabic"
+                language_override = True
+            # Hebrew remains default unless explicitly changed
+        run_id = run_id or generate_run_id()
+        run_dir = self.output_dir / run_id
+        run_dir.mkdir(parents=True, exist_ok=True)
+
+        # Hebrew unless the user explicitly asked for another language
+        system_prompt, initial_prompt = _LANGUAGE_CONFIG[language if language_override else "hebrew"]
+
+        # Build user prompt based on whether this is a refinement or initial analysis
+        if refinement_prompt and original_run_id:
+            # Refinement mode - reference previous work
+            original_dir = self.output_dir / original_run_id
+            user_prompt = _REFINEMENT_PROMPT_TEMPLATE.format(
+                file_path=file_path,
+                run_dir=run_dir,
+                original_dir=original_dir,
+                refinement_prompt=refinement_prompt
+            )
+        else:
+            # Initial analysis mode
+            # Build base prompt with appropriate language emphasis
+            base_prompt = initial_prompt.format(file_path=file_path, run_dir=run_dir)
+
+            # Add user's custom instructions if provided
+            if additional_instructions:
+                base_prompt += _USER_INSTRUCTIONS_TEMPLATE.format(additional_instructions=additional_instructions)
+
+            # Complete the prompt with requirements
+            user_prompt = base_prompt + _REQUIREMENTS_PROMPT
+
+        # Verify API key is in environment (SDK reads it automatically)
+        api_key = os.environ.get('ANTHROPIC_API_KEY')
+        if not api_key:
+            raise RuntimeError("ANTHROPIC_API_KEY not found in environment")
+
+        logger.debug("API key found in environment (length: %d)", len(api_key))
+
         # Configure agent options - SDK will auto-detect API key from environment
         options = ClaudeAgentOptions(
-            model="sonnet",
+            **self._base_options,
             system_prompt=system_prompt,
-            mcp_servers=mcp_servers,
-            permission_mode="bypassPermissions",  # Valid options: acceptEdits, bypassPermissions, default, plan
             cwd=str(run_dir),
-            setting_sources=[],
-            max_turns=100,
         )
 
-        print(f"DEBUG: Agent configured:")
-        print(f"  - Model: {options.model}")
-        print(f"  - MCP servers: {list(options.mcp_servers.keys())}")
-        print(f"  - Permission mode: {options.permission_mode}")
-        print(f"  - Working directory: {options.cwd}")
-        print(f"  - API key from env: ANTHROPIC_API_KEY={api_key[:15]}...")
+        logger.debug("Agent configured: model=%s, mcp_servers=%s, permission_mode=%s, cwd=%s",
+                     options.model, list(options.mcp_servers), options.permission_mode, options.cwd)
 
         # Execute analysis
-        events = []
+        # When capture is enabled, raw SDK events are appended to a JSONL log in
+        # the run directory (one line per event) instead of being kept in memory
+        if keep_events is None:
+            keep_events = self.capture_raw_events
+        events_log_path = run_dir / "events.jsonl" if keep_events else None
         result_data = {}
 
+        # The callback runs on a worker thread so a slow consumer never stalls the
+        # receive loop. Batch-aware callbacks get grouped entries, others one
+        # entry per call.
+        dispatcher = batcher = deliver = None
+        if event_callback:
+            dispatcher = _CallbackDispatcher(event_callback)
+            deliver = dispatcher.put
+            if _accepts_batches(event_callback):
+                batcher = _CallbackBatcher(dispatcher.put, asyncio.get_running_loop())
+                deliver = batcher.add
+
+        debug = logger.isEnabledFor(logging.DEBUG)
+
         try:
-            async with ClaudeSDKClient(options=options) as client:
-                await client.query(user_prompt)
-
-                # Collect events
-                async for event in client.receive_response():
-                    # DEBUG: Print event to see what we're getting
-                    print(f"DEBUG: Received event type: {type(event)}, hasattr content: {hasattr(event, 'content')}")
-                    if hasattr(event, 'content'):
-                        print(f"DEBUG: Event content: {event.content}")
-
-                    # Parse event to displayable log entry
-                    log_entry = self._parse_event_to_log(event)
-                    if log_entry:
-                        print(f"DEBUG: Parsed log entry: {log_entry}")
-                        if event_callback:
-                            event_callback(log_entry)  # Stream to Flask in real-time
-                    else:
-                        print(f"DEBUG: No log entry parsed from event")
-
-                    events.append(self._serialize_event(event))
-
-                    # Extract tool results
-                    if hasattr(event, 'content'):
-                        for item in event.content if isinstance(event.content, list) else []:
-                            if hasattr(item, 'result'):
-                                result_data.update(item.result if isinstance(item.result, dict) else {})
+            with (_EventLogWriter(events_log_path, self._serialize_event) if events_log_path
+                  else contextlib.nullcontext()) as events_log:
+                async with ClaudeSDKClient(options=options) as client:
+                    await client.query(user_prompt)
+
+                    # Collect events
+                    async for event in client.receive_response():
+                        if debug:
+                            logger.debug("Received event type: %s, content: %s",
+                                         type(event).__name__, getattr(event, 'content', None))
+
+                        if deliver:
+                            # Parse event to displayable log entry (also collects tool results)
+                            log_entry = self._parse_event_to_log(event, result_data)
+                            if log_entry:
+                                if debug:
+                                    logger.debug("Parsed log entry: %s", log_entry)
+                                deliver(log_entry)  # Stream to Flask in real-time
+                            elif debug:
+                                logger.debug("No log entry parsed from event")
+                        else:
+                            # Nobody is listening - only the tool results are needed
+                            self._collect_tool_results(event, result_data)
+
+                        if events_log is not None:
+                            events_log.write(event)
 
         except TimeoutError as e:
             error_msg = (
                 "Control request timeout - API key may be invalid or not set correctly. "
                 f"Error: {str(e)}"
             )
-            print(f"ERROR: {error_msg}")
+            logger.error(error_msg)
             raise RuntimeError(error_msg)
         except Exception as e:
             error_msg = f"Error during analysis: {str(e)}"
-            print(f"ERROR: {error_msg}")
+            logger.error(error_msg)
             raise
+        finally:
+            if batcher is not None:
+                batcher.flush(end_of_batch=True)
+            if dispatcher is not None:
+                await dispatcher.close()
 
         # Find dashboard file
         dashboard_path = run_dir / "dashboard.html"
@@ -571,66 +1045,91 @@ Begin your analysis now!"""
         return {
             "dashboard_path": str(dashboard_path),
             "insights": result_data.get("insights", {}),
-            "events": events,
+            "events_log": str(events_log_path) if events_log_path else None,
             "run_id": run_id
         }
 
     async def _create_fallback_dashboard(self, run_dir: Path, data: dict) -> Path:
         """Create a fallback dashboard if agent fails - IN HEBREW."""
         dashboard_path = run_dir / "dashboard.html"
-        html = f"""
-<!DOCTYPE html>
-<html dir="rtl" lang="he">
-<head>
-    <meta charset="UTF-8">
-    <title>ניתוח נתוני Excel</title>
-    <style>
-        body {{
-            font-family: 'Segoe UI', 'Arial Hebrew', Arial, sans-serif;
-            margin: 20px;
-            direction: rtl;
-            text-align: right;
-        }}
-        .container {{ max-width: 1200px; margin: 0 auto; }}
-        h1 {{ color: #333; }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>תוצאות ניתוח Excel</h1>
-        <h2>נתונים שנותחו:</h2>
-        <pre style="direction: ltr; text-align: left;">{json.dumps(data, indent=2, ensure_ascii=False)}</pre>
-    </div>
-</body>
-</html>
-"""
-        with open(dashboard_path, 'w') as f:
-            f.write(html)
+        # Encoding the data can take a while for large results - do it, and the
+        # write, off the event loop
+        await asyncio.to_thread(self._write_fallback_dashboard, dashboard_path, data)
         return dashboard_path
 
-    def _serialize_event(self, event):
-        """Convert event to JSON-serializable dict."""
-        if hasattr(event, "__dict__"):
-            return {k: self._serialize_event(v) for k, v in event.__dict__.items() if not k.startswith("_")}
-        elif isinstance(event, dict):
-            return {k: self._serialize_event(v) for k, v in event.items()}
-        elif isinstance(event, (list, tuple)):
-            return [self._serialize_event(item) for item in event]
-        else:
-            return str(event) if not isinstance(event, (str, int, float, bool, type(None))) else event
+    @staticmethod
+    def _write_fallback_dashboard(dashboard_path: Path, data: dict):
+        """Render the fallback dashboard HTML and write it in one call."""
+        html = _FALLBACK_DASHBOARD_HTML.substitute(data=_format_json(data))
+        dashboard_path.write_bytes(html.encode('utf-8'))
+
+    def _serialize_event(self, event) -> bytes:
+        """
+        Encode an SDK event as one JSON line for the events log.
+
+        The encoder walks dicts, lists and dataclasses natively; _event_default
+        only sees the leftovers, so there is no Python-level recursion.
+        """
+        try:
+            if orjson is not None:
+                return orjson.dumps(event, default=_event_default,
+                                    option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+            return (json.dumps(event, default=_event_default, ensure_ascii=False) + "\n").encode('utf-8')
+        except (TypeError, ValueError):
+            # Unencodable payload (e.g. out-of-range integers) - never fail the run over the log
+            return (json.dumps({"event_type": type(event).__name__, "repr": str(event)}, ensure_ascii=False) + "\n").encode('utf-8')
+
+
+# One agent (and MCP server) per output directory, shared by all requests
+_agents = {}
+_agents_lock = threading.Lock()
+
+
+# Every analysis runs on one long-lived event loop in a background thread.
+# Its default executor (callback delivery, file writes) is kept small rather
+# than asyncio's min(32, cpu_count + 4) threads.
+_LOOP_EXECUTOR_WORKERS = min(8, (os.cpu_count() or 1) + 2)
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared agent event loop, starting its thread on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+            loop.set_default_executor(ThreadPoolExecutor(
+                max_workers=_LOOP_EXECUTOR_WORKERS, thread_name_prefix="agent-io"
+            ))
+            threading.Thread(target=loop.run_forever, name="agent-event-loop", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def get_agent(output_dir: str = "outputs") -> ExcelAnalysisAgent:
+    """Return the shared ExcelAnalysisAgent for output_dir, creating it on first use."""
+    with _agents_lock:
+        agent = _agents.get(output_dir)
+        if agent is None:
+            agent = _agents[output_dir] = ExcelAnalysisAgent(output_dir)
+        return agent
 
 
 # Synchronous wrapper for Flask
 def analyze_excel_file(file_path: str, output_dir: str = "outputs", event_callback=None,
                        additional_instructions=None, refinement_prompt=None, original_run_id=None,
-                       language="hebrew") -> dict:
+                       language="hebrew", keep_events=None, run_id=None) -> dict:
     """Synchronous wrapper for Flask route. Default language is Hebrew."""
-    agent = ExcelAnalysisAgent(output_dir)
-    return asyncio.run(agent.analyze_file(
+    agent = get_agent(output_dir)
+    future = asyncio.run_coroutine_threadsafe(agent.analyze_file(
         file_path,
         event_callback=event_callback,
         additional_instructions=additional_instructions,
         refinement_prompt=refinement_prompt,
         original_run_id=original_run_id,
-        language=language
-    ))
+        language=language,
+        keep_events=keep_events,
+        run_id=run_id
+    ), _get_loop())
+    return future.result()
@@ -1,23 +1,64 @@
 """
 Flask App for Excel Insights Dashboard
 """
+import atexit
+import logging
 import os
+import queue
+import shutil
 import sys
+import time
 import threading
-from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
-from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify, session, flash
-from werkzeug.utils import secure_filename
+from flask import Flask, Response, render_template, request, redirect, url_for, send_file, jsonify, session, flash
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.routing import BaseConverter
+from werkzeug.utils import safe_join, secure_filename
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:  # orjson is optional - fall back to Flask's stdlib encoder
+    orjson = None
+
+try:
+    import redis
+    from flask_session import Session
+except ImportError:  # Optional - sessions stay in signed cookies without them
+    redis = Session = None
+
 # Load environment variables from .env file
 load_dotenv()
 
+# INFO by default; LOG_LEVEL=DEBUG also shows every activity-log event.
+# Records go through a queue to a listener thread, so request and analysis
+# threads never block on writing stderr (or LOG_FILE, when set)
+log_queue = queue.SimpleQueue()
+log_handlers = [logging.StreamHandler()]
+if os.getenv('LOG_FILE'):
+    log_handlers.append(RotatingFileHandler(os.environ['LOG_FILE'], maxBytes=10 * 1024 * 1024, backupCount=5, encoding='utf-8'))
+for handler in log_handlers:
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+log_listener = QueueListener(log_queue, *log_handlers)
+log_listener.start()
+atexit.register(log_listener.stop)  # Flush queued records on shutdown
+# The queue handler passes the bare message on; the listener's handlers add the prefix
+queue_handler = QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(), handlers=[queue_handler])
+logger = logging.getLogger(__name__)
+
 # Import authentication and database modules
 from auth import AuthManager, login_required, admin_required, registered_user_required, create_guest_session, is_guest_user, is_authenticated_user
 from database import db, User, Analysis, ActivityLog
-from email_service import email_service
 from chat_service import get_chat_service
+from job_store import generate_run_id
+from jobs import MAX_JOB_EVENTS, analysis_jobs, job_store, jobs_changed, persist_job_state, run_analysis_async
 
 # Validate API key is set
 if not os.environ.get('ANTHROPIC_API_KEY'):
@@ -37,52 +78,145 @@ if not os.environ.get('ANTHROPIC_API_KEY'):
     print("="*70 + "\n")
     sys.exit(1)
 else:
-    key_preview = os.environ.get('ANTHROPIC_API_KEY')[:20] + "..."
-    print(f"✅ API Key loaded: {key_preview}")
+    logger.info("API key loaded (length: %d)", len(os.environ['ANTHROPIC_API_KEY']))
+
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes jsonify() responses with orjson."""
+
+    def dumps(self, obj, **kwargs):
+        # Types orjson doesn't know (Decimal, ...) go through Flask's default
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+class RunIdConverter(BaseConverter):
+    """URL converter for run ids - malformed ids 404 at routing time."""
+    regex = r'[0-9A-Za-z_-]{1,40}'
 
-from agent_service import analyze_excel_file
 
 app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'uploads'
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+app.url_map.converters['rid'] = RunIdConverter
+# Can point at a RAM-backed mount (e.g. /dev/shm/excel_uploads) to skip the disk
+# round-trip; files must survive as long as their runs can be refined or chatted about
+app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'uploads')
 app.config['OUTPUT_FOLDER'] = 'outputs'
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size (increased)
-app.config['ALLOWED_EXTENSIONS'] = {'xlsx', 'xls'}
+app.config['ALLOWED_EXTENSIONS'] = frozenset({'xlsx', 'xls'})
+app.config['DASHBOARD_MAX_AGE'] = 60  # Seconds browsers may reuse a dashboard file before revalidating
+app.config['UPLOAD_COPY_BUFFER_SIZE'] = 64 * 1024  # Uploads are written to disk in 64KB chunks
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.config['SESSION_COOKIE_SECURE'] = False  # Set to True in production with HTTPS
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
+# With REDIS_URL set, sessions live server-side in Redis (shared by all
+# workers) and the cookie carries only the session id
+if os.getenv('REDIS_URL') and Session is not None:
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis.Redis.from_url(os.environ['REDIS_URL'])
+    Session(app)
+
 # Ensure directories exist
-Path(app.config['UPLOAD_FOLDER']).mkdir(exist_ok=True)
+Path(app.config['UPLOAD_FOLDER']).mkdir(parents=True, exist_ok=True)
 Path(app.config['OUTPUT_FOLDER']).mkdir(exist_ok=True)
 
 # Initialize authentication manager
 auth_manager = AuthManager('users.xml')
 
-# Track analysis jobs
-analysis_jobs = {}
+# Analyses run on a bounded pool; uploads beyond ANALYSIS_MAX_WORKERS wait in
+# 'starting' until a worker frees up instead of each getting its own thread
+ANALYSIS_MAX_WORKERS = int(os.getenv('ANALYSIS_MAX_WORKERS', '4'))
+analysis_executor = ThreadPoolExecutor(max_workers=ANALYSIS_MAX_WORKERS, thread_name_prefix='analysis')
 
+# A status poll returns at most STATUS_EVENTS_LIMIT of a job's recent
+# activity-log entries
+STATUS_EVENTS_LIMIT = 100
 
-def persist_job_state(run_id):
-    """Persist the current job state to database for session recovery."""
-    # NOTE: Job state persistence is disabled - requires job_state column in database
-    # Uncomment and add migration when implementing full job persistence
-    return
+# An idle status stream sends a comment this often (seconds) so proxies keep
+# it open and disconnected clients are noticed
+STREAM_KEEPALIVE_SECONDS = 15
 
-    # if run_id not in analysis_jobs:
-    #     return
+# Finished jobs are dropped from analysis_jobs this long after they end (the
+# dashboards and database records stay); the janitor runs every few minutes
+JOB_RETENTION_SECONDS = int(os.getenv('JOB_RETENTION_SECONDS', '3600'))
+JOB_CLEANUP_INTERVAL_SECONDS = 300
 
-    # job = analysis_jobs[run_id]
-    # user_id = job.get('user_id')
+# With CELERY_BROKER_URL set, analyses run on Celery workers (see tasks.py)
+# instead of analysis_executor; their progress reaches the web workers
+# through the Redis job store, so that must be configured too
+USE_CELERY = bool(os.getenv('CELERY_BROKER_URL'))
+if USE_CELERY and not job_store.enabled:
+    logger.warning("CELERY_BROKER_URL is set but the Redis job store is not - running analyses in-process")
+    USE_CELERY = False
 
-    # # Skip persistence for guest users (no database tracking)
-    # if not user_id:
-    #     return
 
-    # try:
-    #     Analysis.update_job_state(run_id, job)
-    # except Exception as e:
-    #     print(f"⚠️  Failed to persist job state for {run_id}: {e}")
+def job_status_payload(run_id, job):
+    """Status fields shared by the status poll and the status stream."""
+    payload = {
+        "status": job.get('status', 'unknown'),
+        "message": job.get('message', ''),
+    }
+    if job['status'] == 'completed':
+        result = job.get('result') or {}
+        payload['dashboard_url'] = f"/dashboard/{result.get('run_id', run_id)}"
+        payload['ready'] = True
+    elif job['status'] == 'error':
+        payload['error'] = job.get('error', 'Unknown error')
+        payload['ready'] = False
+    else:
+        payload['ready'] = False
+    return payload
+
+
+def get_job(run_id):
+    """Return the job from this process, or its Redis mirror if another worker runs it."""
+    job = analysis_jobs.get(run_id)
+    if job is None:
+        job = job_store.load(run_id, events_limit=STATUS_EVENTS_LIMIT)
+    return job
+
+
+def submit_analysis(run_id, filepath, output_dir, **kwargs):
+    """Queue a tracked job to run on a Celery worker or the local analysis pool."""
+    if USE_CELERY:
+        from tasks import run_analysis_task
+
+        # The worker owns the job from here; this process reads it back from Redis
+        job = analysis_jobs.pop(run_id)
+        fields = {key: value for key, value in job.items() if key not in ('events', 'event_count')}
+        run_analysis_task.delay(run_id, fields, filepath, output_dir, **kwargs)
+    else:
+        analysis_executor.submit(run_analysis_async, run_id, filepath, output_dir, **kwargs)
+
+
+def evict_finished_jobs():
+    """Remove jobs that completed or failed more than JOB_RETENTION_SECONDS ago."""
+    cutoff = time.monotonic() - JOB_RETENTION_SECONDS
+    expired = [run_id for run_id, job in list(analysis_jobs.items())
+               if job.get('finished_at', cutoff) < cutoff]
+    for run_id in expired:
+        analysis_jobs.pop(run_id, None)
+    if expired:
+        logger.info("Evicted %d finished job(s), %d still tracked", len(expired), len(analysis_jobs))
+
+
+def job_janitor():
+    """Background loop that keeps analysis_jobs from growing forever."""
+    while True:
+        time.sleep(JOB_CLEANUP_INTERVAL_SECONDS)
+        try:
+            evict_finished_jobs()
+        except Exception:
+            logger.exception("Job cleanup failed")
+
+
+threading.Thread(target=job_janitor, name='job-janitor', daemon=True).start()
 
 
 def restore_jobs_from_database():
@@ -122,9 +256,13 @@ def restore_jobs_from_database():
     #     print(f"⚠️  Failed to restore jobs from database: {e}")
 
 
+# Suffixes as os.path.splitext returns them, built once from the config
+ALLOWED_SUFFIXES = frozenset(f".{ext}" for ext in app.config['ALLOWED_EXTENSIONS'])
+
+
 def allowed_file(filename):
     """Check if file extension is allowed."""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+    return os.path.splitext(filename)[1].lower() in ALLOWED_SUFFIXES
 
 
 @app.route('/')
@@ -173,7 +311,7 @@ def login():
 
             except Exception as e:
                 # Database unavailable - continue without DB tracking
-                print(f"⚠️  Database unavailable during login (continuing without DB tracking): {e}")
+                logger.warning("Database unavailable during login (continuing without DB tracking): %s", e)
                 session['user_id'] = None
 
             flash(f'ברוך הבא, {user_data["full_name"]}!', 'success')
@@ -223,7 +361,7 @@ def logout():
                 event_data={'ip': request.remote_addr}
             )
         except Exception as e:
-            print(f"⚠️  Database unavailable during logout: {e}")
+            logger.warning("Database unavailable during logout: %s", e)
 
     session.clear()
 
@@ -235,129 +373,6 @@ def logout():
     return redirect(url_for('login'))
 
 
-def run_analysis_async(run_id, filepath, output_dir, additional_instructions=None, refinement_prompt=None, original_run_id=None):
-    """Run analysis in background thread."""
-    try:
-        if refinement_prompt:
-            analysis_jobs[run_id]['status'] = 'running'
-            analysis_jobs[run_id]['message'] = 'Claude Agent is refining your analysis...'
-        else:
-            analysis_jobs[run_id]['status'] = 'running'
-            analysis_jobs[run_id]['message'] = 'Claude Agent is deeply analyzing your data...'
-
-        # Persist initial running state
-        persist_job_state(run_id)
-
-        # Define event callback to receive real-time events
-        def event_callback(log_entry):
-            """Receive events from agent in real-time."""
-            print(f"Flask received event: {log_entry}")
-            analysis_jobs[run_id]['events'].append(log_entry)
-            analysis_jobs[run_id]['event_count'] += 1
-            print(f"Total events now: {analysis_jobs[run_id]['event_count']}")
-
-            # Persist state every 5 events for efficiency
-            if analysis_jobs[run_id]['event_count'] % 5 == 0:
-                persist_job_state(run_id)
-
-        # Send initial event
-        if refinement_prompt:
-            event_callback({
-                'timestamp': datetime.now().strftime("%H:%M:%S"),
-                'type': 'text',
-                'content': f'Refinement started: "{refinement_prompt[:100]}..."',
-                'icon': '🔄'
-            })
-        elif additional_instructions:
-            event_callback({
-                'timestamp': datetime.now().strftime("%H:%M:%S"),
-                'type': 'text',
-                'content': f'Analysis started with custom instructions: "{additional_instructions[:100]}..."',
-                'icon': '🚀'
-            })
-        else:
-            event_callback({
-                'timestamp': datetime.now().strftime("%H:%M:%S"),
-                'type': 'text',
-                'content': 'Analysis started - initializing Claude Agent SDK...',
-                'icon': '🚀'
-            })
-
-        result = analyze_excel_file(
-            file_path=filepath,
-            output_dir=output_dir,
-            event_callback=event_callback,
-            additional_instructions=additional_instructions,
-            refinement_prompt=refinement_prompt,
-            original_run_id=original_run_id
-        )
-
-        analysis_jobs[run_id]['status'] = 'completed'
-        analysis_jobs[run_id]['result'] = result
-        analysis_jobs[run_id]['message'] = 'Analysis complete!' if not refinement_prompt else 'Refinement complete!'
-
-        # Update database status (skip for guests)
-        user_id = analysis_jobs[run_id].get('user_id')
-        if user_id:
-            try:
-                Analysis.update_status(run_id, 'completed', result)
-                print(f"✅ Updated database status to 'completed' for run_id: {run_id}")
-            except Exception as db_error:
-                print(f"⚠️ Failed to update database status: {db_error}")
-
-        # Persist completed state
-        persist_job_state(run_id)
-
-        # Send email notification if requested
-        if analysis_jobs[run_id].get('send_email') and analysis_jobs[run_id].get('user_email'):
-            try:
-                # Build full dashboard URL
-                base_url = request.url_root if request else 'http://localhost:5000/'
-                dashboard_url = f"{base_url}dashboard/{run_id}"
-
-                email_service.send_analysis_complete(
-                    to_email=analysis_jobs[run_id]['user_email'],
-                    user_name=analysis_jobs[run_id].get('user_full_name', 'User'),
-                    filename=analysis_jobs[run_id].get('filename', 'file.xlsx'),
-                    dashboard_url=dashboard_url,
-                    run_id=run_id
-                )
-                print(f"✉️ Email notification sent to {analysis_jobs[run_id]['user_email']}")
-            except Exception as email_error:
-                print(f"❌ Failed to send email notification: {email_error}")
-
-    except Exception as e:
-        analysis_jobs[run_id]['status'] = 'error'
-        analysis_jobs[run_id]['error'] = str(e)
-        analysis_jobs[run_id]['message'] = f'Error: {str(e)}'
-
-        # Update database status (skip for guests)
-        user_id = analysis_jobs[run_id].get('user_id')
-        if user_id:
-            try:
-                Analysis.update_status(run_id, 'error', {'error': str(e)})
-                print(f"✅ Updated database status to 'error' for run_id: {run_id}")
-            except Exception as db_error:
-                print(f"⚠️ Failed to update database status: {db_error}")
-
-        # Persist error state
-        persist_job_state(run_id)
-
-        # Send error notification email if requested
-        if analysis_jobs[run_id].get('send_email') and analysis_jobs[run_id].get('user_email'):
-            try:
-                email_service.send_analysis_error(
-                    to_email=analysis_jobs[run_id]['user_email'],
-                    user_name=analysis_jobs[run_id].get('user_full_name', 'User'),
-                    filename=analysis_jobs[run_id].get('filename', 'file.xlsx'),
-                    error_message=str(e),
-                    run_id=run_id
-                )
-                print(f"✉️ Error notification sent to {analysis_jobs[run_id]['user_email']}")
-            except Exception as email_error:
-                print(f"❌ Failed to send error notification: {email_error}")
-
-
 @app.route('/upload', methods=['POST'])
 @login_required
 def upload_file():
@@ -373,10 +388,13 @@ def upload_file():
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        # Unbuffered: copyfileobj already writes whole chunks
+        with open(filepath, 'wb', buffering=0) as dst:
+            shutil.copyfileobj(file.stream, dst, length=app.config['UPLOAD_COPY_BUFFER_SIZE'])
+            filesize = dst.tell()
 
         # Generate run_id
-        run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        run_id = generate_run_id()
 
         # Create analysis record in database (skip for guests)
         user_id = session.get('user_id')
@@ -395,11 +413,11 @@ def upload_file():
                     user_id=user_id,
                     analysis_id=db_analysis['id'],
                     event_type='upload',
-                    event_data={'filename': filename, 'filesize': os.path.getsize(filepath)}
+                    event_data={'filename': filename, 'filesize': filesize}
                 )
 
             except Exception as e:
-                print(f"Database error during upload: {e}")
+                logger.error("Database error during upload: %s", e)
 
         # Get email notification preference
         send_email = request.form.get('send_email') == 'true'
@@ -415,7 +433,7 @@ def upload_file():
             'message': 'Starting analysis...',
             'filename': filename,
             'user_id': user_id,
-            'events': [],  # Store activity log
+            'events': deque(maxlen=MAX_JOB_EVENTS),  # Recent activity log
             'event_count': 0,  # Track for efficient polling
             'send_email': send_email and user_email is not None,  # Only if user has email
             'user_email': user_email,
@@ -423,16 +441,15 @@ def upload_file():
             'additional_instructions': additional_instructions  # Store user instructions
         }
 
+        job_store.save(run_id, analysis_jobs[run_id])
+
         # Persist initial job state
         persist_job_state(run_id)
 
-        # Start analysis in background thread (NO TIMEOUT!)
-        thread = threading.Thread(
-            target=run_analysis_async,
-            args=(run_id, filepath, app.config['OUTPUT_FOLDER'], additional_instructions)
+        # Start analysis in the background (NO TIMEOUT!)
+        submit_analysis(
+            run_id, filepath, app.config['OUTPUT_FOLDER'], additional_instructions=additional_instructions
         )
-        thread.daemon = True
-        thread.start()
 
         return jsonify({
             "success": True,
@@ -443,7 +460,7 @@ def upload_file():
     return jsonify({"error": "Invalid file type. Only .xlsx and .xls allowed"}), 400
 
 
-@app.route('/dashboard/<run_id>')
+@app.route('/dashboard/<rid:run_id>')
 @login_required
 def view_dashboard(run_id):
     """Display the generated dashboard with refinement panel."""
@@ -465,7 +482,7 @@ def view_dashboard(run_id):
                         event_data={'run_id': run_id}
                     )
             except Exception as e:
-                print(f"Error logging dashboard view: {e}")
+                logger.error("Error logging dashboard view: %s", e)
 
         # Return wrapper template with refinement form
         return render_template('dashboard_wrapper.html', run_id=run_id, user=session.get('user'))
@@ -473,37 +490,73 @@ def view_dashboard(run_id):
         return "Dashboard not found", 404
 
 
-@app.route('/dashboard-content/<run_id>')
+# Recently viewed dashboards stay in memory; the file's mtime and size are
+# part of the key, so a rewritten dashboard is read again
+DASHBOARD_CACHE_SIZE = 32
+
+
+# File types the dashboard iframe may load from a run's output directory
+VISUALIZATION_SUFFIXES = ('.html', '.json')
+
+
+@lru_cache(maxsize=DASHBOARD_CACHE_SIZE)
+def read_dashboard(path, mtime_ns, size):
+    """Read a dashboard file (mtime_ns and size only key the cache)."""
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@app.route('/dashboard-content/<rid:run_id>')
 def view_dashboard_content(run_id):
     """Serve the raw dashboard HTML (for iframe)."""
     dashboard_path = Path(app.config['OUTPUT_FOLDER']) / run_id / "dashboard.html"
 
-    if dashboard_path.exists():
-        return send_file(dashboard_path)
-    else:
+    try:
+        stat = dashboard_path.stat()
+    except OSError:
         return "Dashboard not found", 404
 
+    response = Response(read_dashboard(str(dashboard_path), stat.st_mtime_ns, stat.st_size), mimetype='text/html')
+    # ETag/Last-Modified let reloads of an unchanged dashboard return 304
+    response.set_etag(f"{stat.st_mtime_ns}-{stat.st_size}")
+    response.last_modified = stat.st_mtime
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['DASHBOARD_MAX_AGE']
+    return response.make_conditional(request)
+
 
-@app.route('/dashboard-content/<run_id>/<filename>')
+@app.route('/dashboard-content/<rid:run_id>/<filename>')
 def serve_visualization_file(run_id, filename):
     """Serve individual visualization files from session directory (safety net for multi-file dashboards)."""
     # Security: Only allow .html, .json files
-    if not (filename.endswith('.html') or filename.endswith('.json')):
+    if not filename.endswith(VISUALIZATION_SUFFIXES):
         return "Invalid file type", 400
 
-    file_path = Path(app.config['OUTPUT_FOLDER']) / run_id / filename
+    # Security: resolve symlinks and '..' and refuse anything outside this run's directory
+    output_root = Path(app.config['OUTPUT_FOLDER']).resolve()
+    run_dir = (output_root / run_id).resolve()
+    file_path = (run_dir / filename).resolve()
+    if run_dir.parent != output_root or not file_path.is_relative_to(run_dir):
+        return f"File not found: {filename}", 404
 
-    if file_path.exists() and file_path.is_file():
-        return send_file(file_path)
+    if file_path.is_file():
+        return send_file(file_path, conditional=True, max_age=app.config['DASHBOARD_MAX_AGE'])
     else:
         return f"File not found: {filename}", 404
 
 
-@app.route('/refine/<run_id>', methods=['POST'])
+@app.route('/refine/<rid:run_id>', methods=['POST'])
 @login_required
 def refine_analysis(run_id):
     """Refine existing analysis based on user feedback."""
-    if run_id not in analysis_jobs:
+    original_job = get_job(run_id)
+    if original_job is None:
+        # Finished jobs are evicted from memory - fall back to the database record
+        try:
+            original_job = Analysis.get_by_run_id(run_id)
+        except Exception as e:
+            logger.error("Error loading analysis %s: %s", run_id, e)
+    if original_job is None:
         return jsonify({"error": "Original analysis not found"}), 404
 
     data = request.get_json()
@@ -512,16 +565,16 @@ def refine_analysis(run_id):
     if not refinement_prompt:
         return jsonify({"error": "Refinement prompt is required"}), 400
 
-    original_job = analysis_jobs[run_id]
     original_filename = original_job.get('filename', 'unknown')
-    original_filepath = os.path.join(app.config['UPLOAD_FOLDER'], original_filename)
+    # safe_join returns None if the stored filename would escape UPLOAD_FOLDER
+    original_filepath = safe_join(app.config['UPLOAD_FOLDER'], original_filename)
 
     # Check if original file still exists
-    if not os.path.exists(original_filepath):
+    if not original_filepath or not os.path.exists(original_filepath):
         return jsonify({"error": "Original Excel file not found"}), 404
 
     # Generate new run_id for refinement
-    new_run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    new_run_id = generate_run_id()
 
     # Create refinement analysis record (skip for guests)
     user_id = session.get('user_id')
@@ -549,7 +602,7 @@ def refine_analysis(run_id):
             )
 
         except Exception as e:
-            print(f"Database error during refinement: {e}")
+            logger.error("Database error during refinement: %s", e)
 
     # Initialize job tracking
     analysis_jobs[new_run_id] = {
@@ -557,23 +610,23 @@ def refine_analysis(run_id):
         'message': 'Refining analysis based on your feedback...',
         'filename': original_filename,
         'user_id': user_id,
-        'events': [],
+        'events': deque(maxlen=MAX_JOB_EVENTS),
         'event_count': 0,
         'is_refinement': True,
         'original_run_id': run_id,
         'refinement_prompt': refinement_prompt
     }
 
+    job_store.save(new_run_id, analysis_jobs[new_run_id])
+
     # Persist initial refinement job state
     persist_job_state(new_run_id)
 
-    # Start refinement in background thread
-    thread = threading.Thread(
-        target=run_analysis_async,
-        args=(new_run_id, original_filepath, app.config['OUTPUT_FOLDER'], refinement_prompt, run_id)
+    # Start refinement in the background
+    submit_analysis(
+        new_run_id, original_filepath, app.config['OUTPUT_FOLDER'],
+        refinement_prompt=refinement_prompt, original_run_id=run_id
     )
-    thread.daemon = True
-    thread.start()
 
     return jsonify({
         "success": True,
@@ -582,50 +635,149 @@ def refine_analysis(run_id):
     })
 
 
-@app.route('/status/<run_id>')
+@app.route('/status/<rid:run_id>')
 @login_required
 def check_status(run_id):
     """Check analysis status with detailed progress."""
-    if run_id not in analysis_jobs:
+    job = get_job(run_id)
+    if job is None:
         return jsonify({"status": "not_found", "error": "Analysis job not found"}), 404
 
-    job = analysis_jobs[run_id]
+    # Clients pass the event_count they already have (next_since of the
+    # previous poll) and get only the entries after it
+    since = request.args.get('since', type=int)
+    event_count = job.get('event_count', 0)
 
-    # Update database status (skip for guests)
-    is_guest = session.get('is_guest', False)
-    if not is_guest:
-        try:
-            if job['status'] == 'completed':
-                Analysis.update_status(run_id, 'completed', job.get('result'))
-            elif job['status'] == 'error':
-                Analysis.update_status(run_id, 'error', {'error': job.get('error')})
-        except Exception as e:
-            print(f"Error updating analysis status: {e}")
+    # Nothing changed since the client's last poll - skip the body entirely
+    etag = f"{event_count}-{job['status']}" if since is None else f"{event_count}-{job['status']}-{since}"
+    if request.if_none_match.contains(etag):
+        return '', 304, {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
 
-    response = {
-        "status": job.get('status', 'unknown'),
-        "message": job.get('message', ''),
+    # Record a terminal status in the database once (skip for guests), unless
+    # the analysis thread already did; the flag is claimed under the lock so
+    # concurrent polls don't both write. Jobs run by another worker are
+    # recorded by that worker.
+    is_guest = session.get('is_guest', False)
+    is_local = analysis_jobs.get(run_id) is job
+    if not is_guest and is_local and job['status'] in ('completed', 'error'):
+        with jobs_changed:
+            finalize = not job.get('db_finalized')
+            job['db_finalized'] = True
+        if finalize:
+            try:
+                if job['status'] == 'completed':
+                    Analysis.update_status(run_id, 'completed', job.get('result'))
+                else:
+                    Analysis.update_status(run_id, 'error', {'error': job.get('error')})
+            except Exception as e:
+                with jobs_changed:
+                    job['db_finalized'] = False
+                logger.error("Error updating analysis status: %s", e)
+
+    # Copy under the lock - the analysis thread may be extending the deque
+    with jobs_changed:
+        event_count = job.get('event_count', 0)
+        if since is None:
+            # Return only the tail to avoid huge payloads
+            new_count = STATUS_EVENTS_LIMIT
+        else:
+            new_count = max(event_count - since, 0)
+        events = job.get('events', ())
+        events = list(islice(events, max(len(events) - new_count, 0), None)) if new_count else []
+    response = job_status_payload(run_id, job)
+    response.update({
         "filename": job.get('filename', ''),
-        "events": job.get('events', [])[-100:],  # Return last 100 events to avoid huge payloads
-        "event_count": job.get('event_count', 0)
-    }
+        "events": events,
+        "event_count": event_count,
+        "next_since": event_count
+    })
+
+    response = jsonify(response)
+    response.set_etag(etag)
+    # Browsers revalidate every poll, so fetch() sends If-None-Match on its own
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/status/<rid:run_id>/stream')
+@login_required
+def stream_status(run_id):
+    """Push activity-log entries and status changes as Server-Sent Events."""
+    job = analysis_jobs.get(run_id)
+    if job is not None:
+        def next_update(sent_count, sent_status):
+            with jobs_changed:
+                # The condition is shared by all jobs - go back to sleep when
+                # another job's update woke us, so keepalives only follow a timeout
+                jobs_changed.wait_for(
+                    lambda: job['event_count'] != sent_count or job_status_payload(run_id, job) != sent_status,
+                    STREAM_KEEPALIVE_SECONDS
+                )
+                event_count = job['event_count']
+                events = job['events']
+                new_events = list(islice(events, max(len(events) - (event_count - sent_count), 0), None))
+                return event_count, new_events, job_status_payload(run_id, job)
+        subscription = None
+
+    elif job_store.enabled:
+        # Run by another worker - wait on its Redis channel instead of the local
+        # condition (subscribe first so no update between load and wait is lost)
+        subscription = job_store.subscribe(run_id)
+        if job_store.load(run_id, events_limit=0) is None:
+            subscription.close()
+            return jsonify({"status": "not_found", "error": "Analysis job not found"}), 404
+
+        def next_update(sent_count, sent_status):
+            remote_job = job_store.load(run_id, events_limit=0)
+            if remote_job and remote_job['event_count'] == sent_count and job_status_payload(run_id, remote_job) == sent_status:
+                subscription.get_message(timeout=STREAM_KEEPALIVE_SECONDS)
+                remote_job = job_store.load(run_id, events_limit=0)
+            if remote_job is None:
+                return sent_count, [], {"status": "error", "message": "Analysis job expired", "error": "Analysis job not found", "ready": False}
+            if remote_job['event_count'] > sent_count:
+                remote_job = job_store.load(run_id, events_limit=min(remote_job['event_count'] - sent_count, MAX_JOB_EVENTS)) or remote_job
+            event_count = remote_job['event_count']
+            events = remote_job['events']
+            new_events = events[max(len(events) - (event_count - sent_count), 0):]
+            return event_count, new_events, job_status_payload(run_id, remote_job)
 
-    if job['status'] == 'completed':
-        result = job.get('result', {})
-        response['dashboard_url'] = f"/dashboard/{result.get('run_id', run_id)}"
-        response['ready'] = True
-    elif job['status'] == 'error':
-        response['error'] = job.get('error', 'Unknown error')
-        response['ready'] = False
     else:
-        response['ready'] = False
+        return jsonify({"status": "not_found", "error": "Analysis job not found"}), 404
 
-    return jsonify(response)
+    def generate():
+        sent_count = 0
+        sent_status = None
+        try:
+            while True:
+                event_count, new_events, status = next_update(sent_count, sent_status)
+
+                idle = True
+                if event_count > sent_count:
+                    # event_count lets the client resume by polling without duplicates
+                    yield f"event: log\ndata: {app.json.dumps({'events': new_events, 'event_count': event_count})}\n\n"
+                    sent_count = event_count
+                    idle = False
+                if status != sent_status:
+                    yield f"event: status\ndata: {app.json.dumps(status)}\n\n"
+                    sent_status = status
+                    idle = False
+                if status['status'] in ('completed', 'error'):
+                    return
+                if idle:
+                    yield ": keepalive\n\n"
+        finally:
+            if subscription is not None:
+                subscription.close()
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Don't let nginx buffer the stream
+    })
 
 
 # ========== CHAT ROUTES ==========
 
-@app.route('/chat/<run_id>/init', methods=['POST'])
+@app.route('/chat/<rid:run_id>/init', methods=['POST'])
 @login_required
 def init_chat_session(run_id):
     """Initialize a chat session for an Excel file."""
@@ -634,11 +786,12 @@ def init_chat_session(run_id):
     filename = None
     dashboard_path = None
 
-    # First, try to get from in-memory analysis_jobs (for fresh uploads)
-    if run_id in analysis_jobs:
-        filename = analysis_jobs[run_id].get('filename')
+    # First, try the job tracking (for fresh uploads)
+    job = get_job(run_id)
+    if job:
+        filename = job.get('filename')
         if filename:
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            file_path = safe_join(app.config['UPLOAD_FOLDER'], filename)
 
     # If not found, try to get from database (for history access)
     if not file_path:
@@ -646,9 +799,9 @@ def init_chat_session(run_id):
             analysis = Analysis.get_by_run_id(run_id)
             if analysis and analysis.get('filename'):
                 filename = analysis['filename']
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                file_path = safe_join(app.config['UPLOAD_FOLDER'], filename)
         except Exception as e:
-            print(f"Error looking up analysis from database: {e}")
+            logger.error("Error looking up analysis from database: %s", e)
 
     # Check if file exists
     if not file_path or not os.path.exists(file_path):
@@ -678,7 +831,7 @@ def init_chat_session(run_id):
         }), 500
 
 
-@app.route('/chat/<run_id>', methods=['GET'])
+@app.route('/chat/<rid:run_id>', methods=['GET'])
 @login_required
 def get_chat_info(run_id):
     """Get chat session info and conversation history."""
@@ -706,7 +859,7 @@ def get_chat_info(run_id):
         }), 500
 
 
-@app.route('/chat/<run_id>/message', methods=['POST'])
+@app.route('/chat/<rid:run_id>/message', methods=['POST'])
 @login_required
 def send_chat_message(run_id):
     """Send a message in the chat session."""
@@ -736,7 +889,7 @@ def send_chat_message(run_id):
         }), 500
 
 
-@app.route('/chat/<run_id>/clear', methods=['POST'])
+@app.route('/chat/<rid:run_id>/clear', methods=['POST'])
 @login_required
 def clear_chat_session(run_id):
     """Clear a chat session."""
@@ -781,9 +934,9 @@ def get_active_jobs():
         jobs_list = []
         for job_record in active_jobs:
             run_id = job_record['run_id']
-            # Check if job is in memory
-            if run_id in analysis_jobs:
-                job = analysis_jobs[run_id]
+            # Check if job is still tracked (here or by another worker)
+            job = get_job(run_id)
+            if job:
                 jobs_list.append({
                     'run_id': run_id,
                     'filename': job.get('filename', ''),
@@ -800,16 +953,16 @@ def get_active_jobs():
                         'error',
                         {'error': 'Server restarted - job state lost'}
                     )
-                    print(f"⚠️ Marked stale job {run_id} as error (server restart)")
+                    logger.warning("Marked stale job %s as error (server restart)", run_id)
                 except Exception as update_error:
-                    print(f"⚠️ Failed to update stale job {run_id}: {update_error}")
+                    logger.warning("Failed to update stale job %s: %s", run_id, update_error)
 
                 # Don't include in active jobs list since it's stale
 
         return jsonify({"active_jobs": jobs_list})
 
     except Exception as e:
-        print(f"Error getting active jobs: {e}")
+        logger.error("Error getting active jobs: %s", e)
         return jsonify({"active_jobs": [], "error": str(e)})
 
 
@@ -819,16 +972,15 @@ def get_active_jobs():
 @login_required
 def my_history():
     """User history page - view past analyses and activity."""
-    print(f"📊 /my-history accessed by user: {session.get('user', {}).get('username', 'unknown')}")
-    print(f"   Session user_id: {session.get('user_id')}")
-    print(f"   Is guest: {session.get('is_guest', False)}")
+    logger.debug("/my-history accessed by user: %s (user_id: %s, guest: %s)",
+                 session.get('user', {}).get('username', 'unknown'), session.get('user_id'), session.get('is_guest', False))
 
     user_id = session.get('user_id')
     is_guest = session.get('is_guest', False)
 
     # Guests don't have database history
     if is_guest:
-        print(f"📊 Showing empty history for guest user")
+        logger.debug("Showing empty history for guest user")
         return render_template('history.html',
                              analyses=[],
                              activity_logs=[],
@@ -837,7 +989,7 @@ def my_history():
 
     # Authenticated user but no database ID (database was unavailable during login)
     if not user_id:
-        print(f"📊 Authenticated user but no database ID - database may be unavailable")
+        logger.warning("Authenticated user but no database ID - database may be unavailable")
         return render_template('history.html',
                              analyses=[],
                              activity_logs=[],
@@ -846,15 +998,13 @@ def my_history():
                              database_unavailable=True)
 
     try:
-        print(f"📊 Fetching analyses for user_id: {user_id}")
         # Get user's analyses
         analyses = Analysis.get_user_analyses(user_id, limit=100)
-        print(f"   Found {len(analyses) if analyses else 0} analyses")
 
-        print(f"📊 Fetching activity logs for user_id: {user_id}")
         # Get user's activity logs
         activity_logs = ActivityLog.get_user_activity(user_id, limit=200)
-        print(f"   Found {len(activity_logs) if activity_logs else 0} activity logs")
+        logger.debug("History for user_id %s: %d analyses, %d activity logs",
+                     user_id, len(analyses) if analyses else 0, len(activity_logs) if activity_logs else 0)
 
         return render_template('history.html',
                              analyses=analyses,
@@ -863,10 +1013,7 @@ def my_history():
                              user=session.get('user'))
 
     except Exception as e:
-        print(f"❌ Error in /my-history route: {str(e)}")
-        print(f"   Exception type: {type(e).__name__}")
-        import traceback
-        print(f"   Traceback: {traceback.format_exc()}")
+        logger.exception("Error in /my-history route")
 
         # Instead of redirecting, show error page with details
         flash(f'שגיאה בטעינת ההיסטוריה: {str(e)}', 'error')
@@ -890,53 +1037,31 @@ def admin_panel():
         # Get all users from YAML
         yaml_users = auth_manager.get_all_users()
 
-        # Get user activity from database
+        # One query per kind of data for all users, instead of three per user
+        try:
+            db_users = User.get_by_usernames([user['username'] for user in yaml_users])
+            user_ids = [db_user['id'] for db_user in db_users.values()]
+            analyses_counts = Analysis.counts_by_user_ids(user_ids)
+            recent_activity = ActivityLog.recent_by_user_ids(user_ids, per_user=10)
+        except Exception as e:
+            logger.error("Error getting user stats: %s", e)
+            db_users, analyses_counts, recent_activity = {}, {}, {}
+
         users_with_stats = []
         for user in yaml_users:
-            try:
-                db_user = User.get_by_username(user['username'])
-                if db_user:
-                    # Get user analyses count
-                    analyses = Analysis.get_user_analyses(db_user['id'], limit=1000)
-                    analyses_count = len(analyses)
-
-                    # Get recent activity
-                    recent_activity = ActivityLog.get_user_activity(db_user['id'], limit=10)
-
-                    users_with_stats.append({
-                        'username': user['username'],
-                        'full_name': user['full_name'],
-                        'email': user.get('email'),
-                        'role': user['role'],
-                        'last_login': db_user.get('last_login'),
-                        'created_at': db_user.get('created_at'),
-                        'analyses_count': analyses_count,
-                        'recent_activity': recent_activity
-                    })
-                else:
-                    # User exists in YAML but not in DB yet
-                    users_with_stats.append({
-                        'username': user['username'],
-                        'full_name': user['full_name'],
-                        'email': user.get('email'),
-                        'role': user['role'],
-                        'last_login': None,
-                        'created_at': None,
-                        'analyses_count': 0,
-                        'recent_activity': []
-                    })
-            except Exception as e:
-                print(f"Error getting stats for user {user['username']}: {e}")
-                users_with_stats.append({
-                    'username': user['username'],
-                    'full_name': user['full_name'],
-                    'email': user.get('email'),
-                    'role': user['role'],
-                    'last_login': None,
-                    'created_at': None,
-                    'analyses_count': 0,
-                    'recent_activity': []
-                })
+            # Users in YAML but not in the DB yet get empty stats
+            db_user = db_users.get(user['username']) or {}
+            user_id = db_user.get('id')
+            users_with_stats.append({
+                'username': user['username'],
+                'full_name': user['full_name'],
+                'email': user.get('email'),
+                'role': user['role'],
+                'last_login': db_user.get('last_login'),
+                'created_at': db_user.get('created_at'),
+                'analyses_count': analyses_counts.get(user_id, 0),
+                'recent_activity': recent_activity.get(user_id, [])
+            })
 
         return render_template('admin.html', users=users_with_stats, user=session.get('user'))
 
@@ -1059,8 +1184,10 @@ def admin_delete_user():
 
 
 if __name__ == '__main__':
+    # Development server only - production runs `gunicorn -c gunicorn_conf.py wsgi:app`
+
     # Restore any active jobs from database on startup
-    print("🔄 Checking for active jobs to restore...")
+    logger.info("Checking for active jobs to restore...")
     restore_jobs_from_database()
 
     # Disable reloader to prevent Flask from restarting when agent creates/edits files
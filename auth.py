@@ -2,6 +2,10 @@
 Authentication utilities for Excel Insights Dashboard
 Handles user authentication via users.xml with bcrypt password hashing
 """
+import contextlib
+import os
+import shutil
+import tempfile
 import xml.etree.ElementTree as ET
 import bcrypt
 from functools import wraps
@@ -14,7 +18,24 @@ class AuthManager:
 
     def __init__(self, config_path='users.xml'):
         self.config_path = Path(config_path)
-        self.users = self._load_users()
+        self._users = None
+        self._file_version = None
+        self.reload_users()
+
+    def _stat_version(self):
+        """Identify the current contents of the config file by mtime and size."""
+        try:
+            stat = self.config_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @property
+    def users(self):
+        """Parsed users, re-read only when the config file changed on disk (e.g. edited by another worker)."""
+        if self._stat_version() != self._file_version:
+            self.reload_users()
+        return self._users
 
     def _load_users(self):
         """Load users from XML configuration file."""
@@ -40,7 +61,10 @@ class AuthManager:
 
     def reload_users(self):
         """Reload users from config file (useful after adding new users)."""
-        self.users = self._load_users()
+        # Stat before parsing so a write during the parse triggers another reload
+        version = self._stat_version()
+        self._users = self._load_users()
+        self._file_version = version
 
     def authenticate(self, username, password):
         """
@@ -136,8 +160,7 @@ class AuthManager:
         ET.SubElement(user_elem, 'email_notifications').text = str(email_notifications).lower()
 
         # Write back to file with proper formatting
-        self._indent_xml(root)
-        tree.write(self.config_path, encoding='UTF-8', xml_declaration=True)
+        self._write_tree(tree)
 
         # Reload users
         self.reload_users()
@@ -191,8 +214,7 @@ class AuthManager:
                 break
 
         # Write back to file
-        self._indent_xml(root)
-        tree.write(self.config_path, encoding='UTF-8', xml_declaration=True)
+        self._write_tree(tree)
 
         # Reload users
         self.reload_users()
@@ -227,14 +249,35 @@ class AuthManager:
                 break
 
         # Write back to file
-        self._indent_xml(root)
-        tree.write(self.config_path, encoding='UTF-8', xml_declaration=True)
+        self._write_tree(tree)
 
         # Reload users
         self.reload_users()
 
         return True
 
+    def _write_tree(self, tree):
+        """
+        Write the users tree back to users.xml atomically.
+
+        The XML goes to a uniquely named temporary file next to the config which
+        then replaces it, so a crash or a concurrent read never sees a
+        half-written file and concurrent writers don't share a temp file. The
+        file keeps its original permissions (it holds password hashes).
+        """
+        self._indent_xml(tree.getroot())
+        fd, tmp_path = tempfile.mkstemp(dir=self.config_path.parent, prefix=self.config_path.name + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                tree.write(f, encoding='UTF-8', xml_declaration=True)
+            if self.config_path.exists():
+                shutil.copymode(self.config_path, tmp_path)
+            os.replace(tmp_path, self.config_path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_path)
+            raise
+
     def _indent_xml(self, elem, level=0):
         """Helper method to add pretty-printing indentation to XML."""
         indent = "\n" + "    " * level
@@ -19,6 +19,21 @@ MAX_USER_MESSAGES = 15
 # Structure: {run_id: {'messages': [...], 'user_message_count': int, 'file_path': str, 'file_text': str}}
 chat_sessions: Dict[str, dict] = {}
 
+# System prompt for every chat turn (constant, so it is part of the cached prefix)
+CHAT_SYSTEM_PROMPT = """You are a helpful data analyst assistant. The user has provided an Excel file (converted to CSV format) and wants to chat with you about it.
+
+The Excel data was shared in the first message. If a previous analysis was already performed on this data, that analysis summary is also included in the first message.
+
+When answering:
+- Be concise and clear
+- Reference specific data points from the Excel data when relevant
+- If a previous analysis is mentioned, acknowledge it and build upon those insights
+- Use the same language as the user's question (Hebrew/English)
+- If asked for calculations, show your work
+- Provide actionable insights when appropriate
+
+IMPORTANT: Always respond in the same language as the user's question. If they write in Hebrew (עברית), respond in Hebrew. If they write in English, respond in English."""
+
 
 class ChatService:
     """Service for managing chat conversations about Excel files."""
@@ -224,20 +239,14 @@ class ChatService:
         dashboard_insights = session.get('dashboard_insights')
 
         # Build conversation history for API call
-        api_messages = []
-
         # CRITICAL: Always include file context, even when loading from history
         # This ensures Claude has access to data even after page refresh
-
-        if session['messages']:
-            # We have conversation history - reconstruct with context
-            # Build the full context (file + optional analysis)
-            context_parts = [f"""Here is the Excel file data in CSV format:
+        context_parts = [f"""Here is the Excel file data in CSV format:
 
 {file_text}"""]
 
-            if dashboard_insights:
-                context_parts.append(f"""
+        if dashboard_insights:
+            context_parts.append(f"""
 
 Additionally, here is a summary of the analysis that was already performed on this data:
 
@@ -245,23 +254,29 @@ Additionally, here is a summary of the analysis that was already performed on th
 {dashboard_insights}
 =========================""")
 
-            # Get the first user message from history
-            first_user_message = session['messages'][0]['content']
-            context_parts.append(f"""
+        # The file context is identical on every turn of a session, so it goes in
+        # its own block marked as a prompt-cache breakpoint. Follow-up questions
+        # then read the system prompt and file data from the cache.
+        context_block = {
+            "type": "text",
+            "text": "\n".join(context_parts),
+            "cache_control": {"type": "ephemeral"}
+        }
 
-Now, please answer this question: {first_user_message}""")
-
-            # Add reconstructed first message with full context
-            api_messages.append({
-                "role": "user",
-                "content": "\n".join(context_parts)
-            })
+        # The first user message carries the context; on later turns it is
+        # rebuilt from the first stored question
+        first_user_message = session['messages'][0]['content'] if session['messages'] else user_message
+        api_messages = [{
+            "role": "user",
+            "content": [
+                context_block,
+                {"type": "text", "text": f"Now, please answer this question: {first_user_message}"}
+            ]
+        }]
 
+        if session['messages']:
             # Add the rest of the conversation history (skip first message, we already added it)
-            for i, msg in enumerate(session['messages']):
-                if i == 0:
-                    continue  # Skip first user message (already added with context)
-
+            for msg in session['messages'][1:]:
                 api_messages.append({
                     "role": msg['role'],
                     "content": msg['content']
@@ -273,48 +288,12 @@ Now, please answer this question: {first_user_message}""")
                 "content": user_message
             })
 
-        else:
-            # First message ever - include full context
-            context_parts = [f"""Here is the Excel file data in CSV format:
-
-{file_text}"""]
-
-            if dashboard_insights:
-                context_parts.append(f"""
-
-Additionally, here is a summary of the analysis that was already performed on this data:
-
-=== PREVIOUS ANALYSIS ===
-{dashboard_insights}
-=========================""")
-
-            context_parts.append(f"""
-
-Now, please answer this question: {user_message}""")
-
-            api_messages.append({
-                "role": "user",
-                "content": "\n".join(context_parts)
-            })
-
         try:
             # Call Claude API
             response = self.client.messages.create(
                 model=self.model,
                 max_tokens=4096,
-                system="""You are a helpful data analyst assistant. The user has provided an Excel file (converted to CSV format) and wants to chat with you about it.
-
-The Excel data was shared in the first message. If a previous analysis was already performed on this data, that analysis summary is also included in the first message.
-
-When answering:
-- Be concise and clear
-- Reference specific data points from the Excel data when relevant
-- If a previous analysis is mentioned, acknowledge it and build upon those insights
-- Use the same language as the user's question (Hebrew/English)
-- If asked for calculations, show your work
-- Provide actionable insights when appropriate
-
-IMPORTANT: Always respond in the same language as the user's question. If they write in Hebrew (עברית), respond in Hebrew. If they write in English, respond in English.""",
+                system=CHAT_SYSTEM_PROMPT,
                 messages=api_messages
             )
 
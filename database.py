@@ -1,13 +1,39 @@
 """
 Database models and connection management for Excel Insights
 """
+import atexit
+import logging
 import os
+import queue
+import threading
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 from datetime import datetime
+from collections import deque
 from contextlib import contextmanager
 import json
 
+try:
+    import orjson
+except ImportError:  # orjson is optional - fall back to the stdlib encoder
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(obj):
+    """Encode bounded event buffers (deques) as plain lists."""
+    if isinstance(obj, deque):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def to_json(data):
+    """Encode a value for a JSONB column (uses orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(data, default=_json_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(data, default=_json_default)
+
 
 class Database:
     """Database connection and query manager."""
@@ -57,6 +83,19 @@ class User:
             )
             return cursor.fetchone()
 
+    @staticmethod
+    def get_by_usernames(usernames):
+        """Get users by username in one query, as a dict keyed by username."""
+        if not usernames:
+            return {}
+        with db.get_connection() as conn:
+            cursor = db.get_cursor(conn)
+            cursor.execute(
+                "SELECT * FROM users WHERE username = ANY(%s)",
+                (list(usernames),)
+            )
+            return {row['username']: row for row in cursor.fetchall()}
+
     @staticmethod
     def get_by_id(user_id):
         """Get user by ID."""
@@ -122,7 +161,7 @@ class Analysis:
                 WHERE run_id = %s
                 RETURNING id, status, completed_at
                 """,
-                (status, json.dumps(result_data) if result_data else None,
+                (status, to_json(result_data) if result_data else None,
                  status, datetime.now(), run_id)
             )
             return cursor.fetchone()
@@ -156,6 +195,24 @@ class Analysis:
             )
             return cursor.fetchall()
 
+    @staticmethod
+    def counts_by_user_ids(user_ids):
+        """Count analyses for several users in one query, as a dict keyed by user_id."""
+        if not user_ids:
+            return {}
+        with db.get_connection() as conn:
+            cursor = db.get_cursor(conn)
+            cursor.execute(
+                """
+                SELECT user_id, COUNT(*) AS analyses_count
+                FROM analyses
+                WHERE user_id = ANY(%s)
+                GROUP BY user_id
+                """,
+                (list(user_ids),)
+            )
+            return {row['user_id']: row['analyses_count'] for row in cursor.fetchall()}
+
     @staticmethod
     def update_job_state(run_id, job_state):
         """Update the job state for persistence across sessions."""
@@ -169,7 +226,7 @@ class Analysis:
                 WHERE run_id = %s
                 RETURNING id
                 """,
-                (json.dumps(job_state), job_state.get('status', 'unknown'), run_id)
+                (to_json(job_state), job_state.get('status', 'unknown'), run_id)
             )
             return cursor.fetchone()
 
@@ -255,7 +312,7 @@ class Conversation:
                 RETURNING id, conversation_id, role, content, created_at
                 """,
                 (conversation_id, role, content,
-                 json.dumps(metadata) if metadata else None, datetime.now())
+                 to_json(metadata) if metadata else None, datetime.now())
             )
             # Update conversation timestamp
             cursor.execute(
@@ -312,25 +369,105 @@ class Conversation:
             return cursor.fetchone()
 
 
+class _ActivityLogWriter:
+    """Inserts queued activity-log rows in batches on a background thread."""
+
+    _STOP = object()
+
+    # Upper bound on rows per INSERT statement
+    MAX_BATCH = 500
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, row):
+        """Queue a row for insertion; never blocks on the database."""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+                    self._thread.start()
+                    # Write out whatever is still queued when the process exits
+                    atexit.register(self.close)
+        self._queue.put(row)
+
+    def close(self):
+        """Flush everything queued so far and stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(self._STOP)
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            # Drain whatever has piled up and insert it with a single statement
+            batch = [self._queue.get()]
+            while len(batch) < self.MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is self._STOP
+            if stop:
+                batch.pop()
+            if batch:
+                try:
+                    with db.get_connection() as conn:
+                        self._insert(conn.cursor(), batch)
+                except Exception as e:
+                    if len(batch) == 1:
+                        logger.error("Failed to write activity log event: %s", e)
+                    else:
+                        # One bad row aborts the whole statement - retry row by row
+                        # so only the offending events are dropped
+                        self._insert_each(batch)
+            if stop:
+                return
+
+    @staticmethod
+    def _insert(cursor, rows):
+        execute_values(
+            cursor,
+            """
+            INSERT INTO activity_logs
+            (user_id, analysis_id, event_type, event_data, created_at)
+            VALUES %s
+            """,
+            rows
+        )
+
+    def _insert_each(self, batch):
+        """Insert rows one at a time on one connection, skipping the ones that fail."""
+        failed = 0
+        try:
+            with db.get_connection() as conn:
+                cursor = conn.cursor()
+                for row in batch:
+                    cursor.execute("SAVEPOINT activity_row")
+                    try:
+                        self._insert(cursor, [row])
+                    except psycopg2.Error as e:
+                        cursor.execute("ROLLBACK TO SAVEPOINT activity_row")
+                        failed += 1
+                        logger.error("Dropped activity log event %r for user %s: %s", row[2], row[0], e)
+                    else:
+                        cursor.execute("RELEASE SAVEPOINT activity_row")
+        except Exception as e:
+            logger.error("Failed to write %d activity log event(s): %s", len(batch) - failed, e)
+
+
+_activity_writer = _ActivityLogWriter()
+
+
 class ActivityLog:
     """Track user activity and events."""
 
     @staticmethod
     def log_event(user_id, analysis_id, event_type, event_data=None):
-        """Log an activity event."""
-        with db.get_connection() as conn:
-            cursor = db.get_cursor(conn)
-            cursor.execute(
-                """
-                INSERT INTO activity_logs
-                (user_id, analysis_id, event_type, event_data, created_at)
-                VALUES (%s, %s, %s, %s, %s)
-                RETURNING id
-                """,
-                (user_id, analysis_id, event_type,
-                 json.dumps(event_data) if event_data else None, datetime.now())
-            )
-            return cursor.fetchone()
+        """Queue an activity event; rows are inserted in batches off the request thread."""
+        _activity_writer.put((user_id, analysis_id, event_type,
+                              to_json(event_data) if event_data else None, datetime.now()))
 
     @staticmethod
     def get_user_activity(user_id, limit=100):
@@ -350,3 +487,31 @@ class ActivityLog:
                 (user_id, limit)
             )
             return cursor.fetchall()
+
+    @staticmethod
+    def recent_by_user_ids(user_ids, per_user=10):
+        """Get each user's most recent activity in one query, as a dict keyed by user_id."""
+        if not user_ids:
+            return {}
+        with db.get_connection() as conn:
+            cursor = db.get_cursor(conn)
+            cursor.execute(
+                """
+                SELECT user_id, id, event_type, event_data, created_at, filename, run_id
+                FROM (
+                    SELECT al.user_id, al.id, al.event_type, al.event_data, al.created_at,
+                           a.filename, a.run_id,
+                           ROW_NUMBER() OVER (PARTITION BY al.user_id ORDER BY al.created_at DESC) AS rn
+                    FROM activity_logs al
+                    LEFT JOIN analyses a ON al.analysis_id = a.id
+                    WHERE al.user_id = ANY(%s)
+                ) recent
+                WHERE rn <= %s
+                ORDER BY user_id, created_at DESC
+                """,
+                (list(user_ids), per_user)
+            )
+            activity = {}
+            for row in cursor.fetchall():
+                activity.setdefault(row.pop('user_id'), []).append(row)
+            return activity
@@ -2,11 +2,14 @@
 Email notification service using SendGrid
 Sends completion notifications to users when analysis jobs finish
 """
+import logging
 import os
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail, Email, To, Content
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 
 class EmailService:
     """SendGrid email service for analysis notifications."""
@@ -17,7 +20,7 @@ class EmailService:
         self.enabled = bool(self.api_key)
 
         if not self.enabled:
-            print("⚠️ WARNING: SENDGRID_API_KEY not set. Email notifications disabled.")
+            logger.warning("SENDGRID_API_KEY not set. Email notifications disabled.")
 
     def send_analysis_complete(self, to_email, user_name, filename, dashboard_url, run_id):
         """
@@ -34,11 +37,11 @@ class EmailService:
             bool: True if sent successfully, False otherwise
         """
         if not self.enabled:
-            print(f"Email notifications disabled. Would have sent to: {to_email}")
+            logger.info("Email notifications disabled. Would have sent to: %s", to_email)
             return False
 
         if not to_email:
-            print("No email address provided for notification")
+            logger.info("No email address provided for notification")
             return False
 
         try:
@@ -179,14 +182,14 @@ class EmailService:
             response = sg.send(message)
 
             if response.status_code in [200, 201, 202]:
-                print(f"✅ Email sent successfully to {to_email}")
+                logger.info("Email sent successfully to %s", to_email)
                 return True
             else:
-                print(f"❌ Email send failed with status: {response.status_code}")
+                logger.error("Email send failed with status: %s", response.status_code)
                 return False
 
         except Exception as e:
-            print(f"❌ Error sending email: {str(e)}")
+            logger.error("Error sending email: %s", e)
             return False
 
     def send_analysis_error(self, to_email, user_name, filename, error_message, run_id):
@@ -255,7 +258,7 @@ class EmailService:
             return response.status_code in [200, 201, 202]
 
         except Exception as e:
-            print(f"Error sending error notification email: {str(e)}")
+            logger.error("Error sending error notification email: %s", e)
             return False
 
 
@@ -0,0 +1,35 @@
+"""
+gunicorn settings for production:
+
+    gunicorn -c gunicorn_conf.py wsgi:app
+
+Workers are threaded (gthread): status streams wait on threading primitives and
+analyses run on a thread pool, so the app needs real threads rather than
+gevent greenlets. Every open status stream holds one thread.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+worker_class = 'gthread'
+
+# Several workers only see each other's jobs through the Redis job store, so
+# without REDIS_URL everything stays in a single worker process. Unless
+# analyses go to Celery (CELERY_BROKER_URL), every worker also runs up to
+# ANALYSIS_MAX_WORKERS agent sessions of its own - workers x that many in
+# total - so only scale workers out by default when Celery does the analyses.
+if os.getenv('REDIS_URL'):
+    default_workers = multiprocessing.cpu_count() * 2 + 1 if os.getenv('CELERY_BROKER_URL') else 1
+    workers = int(os.getenv('GUNICORN_WORKERS', default_workers))
+else:
+    workers = 1
+threads = int(os.getenv('GUNICORN_THREADS', '32'))
+
+# Workers keep heartbeating while threads are busy in long requests (uploads,
+# status streams), so the timeout only catches hung workers
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
@@ -0,0 +1,133 @@
+"""
+Shared job state for analysis runs.
+
+Jobs always live in the process that runs them (the analysis thread updates
+its dict in place). When REDIS_URL is set and the redis package is installed,
+each job's status and recent activity-log entries are mirrored to Redis as
+well, so a gunicorn worker that did not start a run can still answer /status
+for it. Every update is also published on a per-job channel so status streams
+served by other workers wake up without polling Redis.
+
+Run ids are generated here too, so web processes can allocate one without
+importing the agent SDK.
+"""
+import json
+import logging
+import secrets
+import time
+
+try:
+    import redis
+except ImportError:  # Optional - jobs stay process-local without it
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Mirrored jobs expire a day after their last update
+JOB_TTL_SECONDS = 24 * 60 * 60
+
+# Fields copied from the in-process job dict into the Redis hash
+_JOB_FIELDS = ('status', 'message', 'filename', 'error', 'result', 'user_id',
+               'is_refinement', 'original_run_id')
+
+
+def generate_run_id() -> str:
+    """
+    Return a new run id: the start time plus its nanosecond part and a random
+    suffix. The clock alone is not enough where time_ns() only ticks every few
+    milliseconds, and a per-process counter would repeat across gunicorn
+    workers and Celery processes.
+    """
+    ns = time.time_ns()
+    return (time.strftime("%Y%m%d_%H%M%S", time.localtime(ns // 1_000_000_000))
+            + f"_{ns % 1_000_000_000:09d}_{secrets.token_hex(4)}")
+
+
+class JobStore:
+    """Mirror of analysis job state in Redis (a no-op when Redis is unavailable)."""
+
+    def __init__(self, url=None, max_events=500, ttl=JOB_TTL_SECONDS):
+        self.max_events = max_events
+        self.ttl = ttl
+        self.client = None
+        if url and redis is not None:
+            self.client = redis.Redis.from_url(url, decode_responses=True)
+            logger.info("Mirroring analysis jobs to Redis")
+        elif url:
+            logger.warning("REDIS_URL is set but the redis package is not installed - jobs stay in memory")
+
+    @property
+    def enabled(self):
+        return self.client is not None
+
+    @staticmethod
+    def _job_key(run_id):
+        return f"job:{run_id}"
+
+    @staticmethod
+    def _events_key(run_id):
+        return f"job:{run_id}:events"
+
+    @staticmethod
+    def _channel(run_id):
+        return f"job:{run_id}:updates"
+
+    def save(self, run_id, job):
+        """Store the job's status fields (not its events)."""
+        if not self.enabled:
+            return
+        mapping = {field: json.dumps(job.get(field), default=str) for field in _JOB_FIELDS}
+        mapping['event_count'] = job.get('event_count', 0)
+        try:
+            pipe = self.client.pipeline()
+            pipe.hset(self._job_key(run_id), mapping=mapping)
+            pipe.expire(self._job_key(run_id), self.ttl)
+            pipe.publish(self._channel(run_id), mapping['event_count'])
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Failed to mirror job %s to Redis: %s", run_id, e)
+
+    def append_events(self, run_id, entries, event_count):
+        """Append activity-log entries, keeping only the newest max_events."""
+        if not self.enabled or not entries:
+            return
+        events_key = self._events_key(run_id)
+        try:
+            pipe = self.client.pipeline()
+            pipe.rpush(events_key, *(json.dumps(entry) for entry in entries))
+            pipe.ltrim(events_key, -self.max_events, -1)
+            pipe.expire(events_key, self.ttl)
+            pipe.hset(self._job_key(run_id), 'event_count', event_count)
+            pipe.expire(self._job_key(run_id), self.ttl)
+            pipe.publish(self._channel(run_id), event_count)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Failed to mirror events for job %s to Redis: %s", run_id, e)
+
+    def load(self, run_id, events_limit=100):
+        """Return a job dict with its newest events_limit entries, or None."""
+        if not self.enabled:
+            return None
+        try:
+            pipe = self.client.pipeline()
+            pipe.hgetall(self._job_key(run_id))
+            if events_limit > 0:
+                pipe.lrange(self._events_key(run_id), -events_limit, -1)
+            fields, *events = pipe.execute()
+            events = events[0] if events else []
+        except redis.RedisError as e:
+            logger.warning("Failed to load job %s from Redis: %s", run_id, e)
+            return None
+        if not fields:
+            return None
+
+        job = {field: json.loads(fields[field]) for field in _JOB_FIELDS if field in fields}
+        job['event_count'] = int(fields.get('event_count', 0))
+        job['events'] = [json.loads(event) for event in events]
+        return job
+
+    def subscribe(self, run_id):
+        """Return a pub/sub handle that receives a message on every update of the job."""
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self._channel(run_id))
+        return pubsub
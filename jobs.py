@@ -0,0 +1,213 @@
+"""
+Analysis job tracking and the function that runs one analysis.
+
+Shared by the web app and the Celery worker (tasks.py). Importing this
+module has no web side effects - no Flask app, session store, thread pools
+or background threads - so a worker can run analyses without loading app.py.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from flask import request
+
+from database import Analysis
+from email_service import email_service
+from job_store import JobStore
+
+logger = logging.getLogger(__name__)
+
+# Jobs run or tracked by this process, by run id
+analysis_jobs = {}
+
+# Each job keeps only its most recent activity-log entries in memory
+# (event_count still counts all of them)
+MAX_JOB_EVENTS = 500
+
+# Notified whenever a job gets new events or changes status; its lock also
+# guards the job event deques while they are extended or copied
+jobs_changed = threading.Condition()
+
+# Jobs started by this process are also mirrored to Redis (when REDIS_URL is
+# set) so every worker behind the load balancer can report their status
+job_store = JobStore(os.getenv('REDIS_URL'), max_events=MAX_JOB_EVENTS)
+
+
+def notify_job_update():
+    """Wake the status streams after a job's status or message changed."""
+    with jobs_changed:
+        jobs_changed.notify_all()
+
+
+def persist_job_state(run_id):
+    """Persist the current job state to database for session recovery."""
+    # NOTE: Job state persistence is disabled - requires job_state column in database
+    # Uncomment and add migration when implementing full job persistence
+    return
+
+    # if run_id not in analysis_jobs:
+    #     return
+
+    # job = analysis_jobs[run_id]
+    # user_id = job.get('user_id')
+
+    # # Skip persistence for guest users (no database tracking)
+    # if not user_id:
+    #     return
+
+    # try:
+    #     Analysis.update_job_state(run_id, job)
+    # except Exception as e:
+    #     print(f"⚠️  Failed to persist job state for {run_id}: {e}")
+
+
+def run_analysis_async(run_id, filepath, output_dir, additional_instructions=None, refinement_prompt=None, original_run_id=None):
+    """Run analysis in background thread."""
+    # Imported on first use - agent_service pulls in the Claude SDK, pandas and
+    # the MCP tools, which the server does not need to start or fork
+    from agent_service import analyze_excel_file
+
+    job = analysis_jobs[run_id]
+    try:
+        if refinement_prompt:
+            job['status'] = 'running'
+            job['message'] = 'Claude Agent is refining your analysis...'
+        else:
+            job['status'] = 'running'
+            job['message'] = 'Claude Agent is deeply analyzing your data...'
+        job_store.save(run_id, job)
+        notify_job_update()
+
+        # Persist initial running state
+        persist_job_state(run_id)
+
+        # Define event callback to receive real-time events
+        def event_callback(entries, end_of_batch=False):
+            """Receive batches of events from agent in real-time."""
+            with jobs_changed:
+                job['events'].extend(entries)
+                job['event_count'] += len(entries)
+                event_count = job['event_count']
+                jobs_changed.notify_all()
+            job_store.append_events(run_id, entries, event_count)
+            logger.debug("Job %s received %d event(s), %d in total: %s", run_id, len(entries), event_count, entries)
+
+            # Persist state every 5 events for efficiency
+            if event_count // 5 > (event_count - len(entries)) // 5:
+                persist_job_state(run_id)
+
+        # Send initial event
+        if refinement_prompt:
+            event_callback([{
+                'timestamp': datetime.now().strftime("%H:%M:%S"),
+                'type': 'text',
+                'content': f'Refinement started: "{refinement_prompt[:100]}..."',
+                'icon': '🔄'
+            }])
+        elif additional_instructions:
+            event_callback([{
+                'timestamp': datetime.now().strftime("%H:%M:%S"),
+                'type': 'text',
+                'content': f'Analysis started with custom instructions: "{additional_instructions[:100]}..."',
+                'icon': '🚀'
+            }])
+        else:
+            event_callback([{
+                'timestamp': datetime.now().strftime("%H:%M:%S"),
+                'type': 'text',
+                'content': 'Analysis started - initializing Claude Agent SDK...',
+                'icon': '🚀'
+            }])
+
+        result = analyze_excel_file(
+            file_path=filepath,
+            output_dir=output_dir,
+            event_callback=event_callback,
+            additional_instructions=additional_instructions,
+            refinement_prompt=refinement_prompt,
+            original_run_id=original_run_id,
+            run_id=run_id
+        )
+
+        # Claim the database write before publishing the terminal status, so a
+        # status poll in between doesn't record it a second time
+        with jobs_changed:
+            job['db_finalized'] = True
+        job['status'] = 'completed'
+        job['result'] = result
+        job['message'] = 'Analysis complete!' if not refinement_prompt else 'Refinement complete!'
+        job['finished_at'] = time.monotonic()
+        job_store.save(run_id, job)
+        notify_job_update()
+
+        # Update database status (skip for guests)
+        user_id = job.get('user_id')
+        if user_id:
+            try:
+                Analysis.update_status(run_id, 'completed', result)
+                logger.info("Updated database status to 'completed' for run_id: %s", run_id)
+            except Exception as db_error:
+                with jobs_changed:
+                    job['db_finalized'] = False  # Let the next status poll retry
+                logger.warning("Failed to update database status: %s", db_error)
+
+        # Persist completed state
+        persist_job_state(run_id)
+
+        # Send email notification if requested
+        if job.get('send_email') and job.get('user_email'):
+            try:
+                # Build full dashboard URL
+                base_url = request.url_root if request else 'http://localhost:5000/'
+                dashboard_url = f"{base_url}dashboard/{run_id}"
+
+                email_service.send_analysis_complete(
+                    to_email=job['user_email'],
+                    user_name=job.get('user_full_name', 'User'),
+                    filename=job.get('filename', 'file.xlsx'),
+                    dashboard_url=dashboard_url,
+                    run_id=run_id
+                )
+                logger.info("Email notification sent to %s", job['user_email'])
+            except Exception as email_error:
+                logger.error("Failed to send email notification: %s", email_error)
+
+    except Exception as e:
+        with jobs_changed:
+            job['db_finalized'] = True
+        job['status'] = 'error'
+        job['error'] = str(e)
+        job['message'] = f'Error: {str(e)}'
+        job['finished_at'] = time.monotonic()
+        job_store.save(run_id, job)
+        notify_job_update()
+
+        # Update database status (skip for guests)
+        user_id = job.get('user_id')
+        if user_id:
+            try:
+                Analysis.update_status(run_id, 'error', {'error': str(e)})
+                logger.info("Updated database status to 'error' for run_id: %s", run_id)
+            except Exception as db_error:
+                with jobs_changed:
+                    job['db_finalized'] = False  # Let the next status poll retry
+                logger.warning("Failed to update database status: %s", db_error)
+
+        # Persist error state
+        persist_job_state(run_id)
+
+        # Send error notification email if requested
+        if job.get('send_email') and job.get('user_email'):
+            try:
+                email_service.send_analysis_error(
+                    to_email=job['user_email'],
+                    user_name=job.get('user_full_name', 'User'),
+                    filename=job.get('filename', 'file.xlsx'),
+                    error_message=str(e),
+                    run_id=run_id
+                )
+                logger.info("Error notification sent to %s", job['user_email'])
+            except Exception as email_error:
+                logger.error("Failed to send error notification: %s", email_error)
@@ -0,0 +1,45 @@
+"""
+Celery worker for running analyses outside the web processes.
+
+Used when CELERY_BROKER_URL is set (REDIS_URL must be set as well - the web
+workers follow each job's progress through the Redis job store). Workers need
+the same working directory as the web app, since uploads and outputs are
+shared on disk:
+
+    celery -A tasks worker --concurrency 4 --loglevel INFO
+
+Only jobs.py is imported, not the web app, so workers don't build the Flask
+app, its session store or its thread pools.
+"""
+import os
+from collections import deque
+
+from celery import Celery
+from dotenv import load_dotenv
+
+# Read REDIS_URL, DATABASE_URL etc. before jobs.py sets up the job store
+load_dotenv()
+
+from jobs import MAX_JOB_EVENTS, analysis_jobs, run_analysis_async
+
+celery_app = Celery(
+    'excel_insights',
+    broker=os.getenv('CELERY_BROKER_URL'),
+    backend=os.getenv('CELERY_RESULT_BACKEND')
+)
+celery_app.conf.update(
+    task_serializer='json',
+    accept_content=['json'],
+    # Analyses take minutes - hand each worker process one at a time and only
+    # acknowledge once finished, so a crashed worker's job is redelivered
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    task_ignore_result=True
+)
+
+
+@celery_app.task(name='excel_insights.run_analysis')
+def run_analysis_task(run_id, job, filepath, output_dir, **kwargs):
+    """Run one analysis job; its status and events are published to the job store."""
+    analysis_jobs[run_id] = dict(job, events=deque(maxlen=MAX_JOB_EVENTS), event_count=0)
+    run_analysis_async(run_id, filepath, output_dir, **kwargs)
@@ -0,0 +1,11 @@
+"""
+WSGI entry point for serving the dashboard with gunicorn (Linux/macOS):
+
+    gunicorn -c gunicorn_conf.py wsgi:app
+
+See gunicorn_conf.py for worker and thread counts. With more than one worker,
+set REDIS_URL so every worker can see jobs started by the others.
+"""
+from app import app, restore_jobs_from_database
+
+restore_jobs_from_database()